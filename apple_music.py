@@ -187,13 +187,30 @@ def get_selected_songs(bucket_name):
    
    return selected_songs
 
-def select_new_songs(tracks, bucket_name, num_songs=20):
-   # Get songs from spreadsheet that should be excluded
-   sheet_selected_urls = get_sheet_excluded_songs()
+def select_new_songs(tracks, bucket_name, num_songs=20, on_selected=None):
+   """Pick today's songs by normalized views and add them to selected_songs.json.
+   
+   on_selected(index, song) is called for each pick as soon as it is made,
+   best ranked first, so a renderer can start before the list is saved.
+   If today's songs were already selected, those are returned (and passed
+   to on_selected) as they are, so a rerun doesn't add them again.
+   """
+   current_date = datetime.datetime.now().strftime("%Y-%m-%d")
    
    # Get previously selected songs from JSON
    selected_songs = get_selected_songs(bucket_name)
    
+   todays_songs = [song for song in selected_songs if song.get('selected_date') == current_date]
+   if todays_songs:
+       print(f"Already selected {len(todays_songs)} songs for {current_date}, keeping them")
+       if on_selected:
+           for i, song in enumerate(todays_songs):
+               on_selected(i, song)
+       return todays_songs
+   
+   # Get songs from spreadsheet that should be excluded
+   sheet_selected_urls = get_sheet_excluded_songs()
+   
    # Identify songs already processed or tagged for video (from both sources)
    selected_song_ids = set()
    for song in selected_songs:
@@ -210,7 +227,6 @@ def select_new_songs(tracks, bucket_name, num_songs=20):
    new_tracks = [track for track in tracks if track['song_url'] not in selected_song_ids]
    
    # Also get songs from the last 5 days that weren't selected
-   current_date = datetime.datetime.now().strftime("%Y-%m-%d")
    five_days_ago = (datetime.datetime.now() - timedelta(days=5)).strftime("%Y-%m-%d")
    
    # Get songs from previous scrapes in the last 5 days
@@ -295,6 +311,8 @@ def select_new_songs(tracks, bucket_name, num_songs=20):
    for i, track in enumerate(newly_selected):
        track['create_video'] = False
        track['video_url'] = generate_video_url(track, i, bucket_name, current_date)
+       if on_selected:
+           on_selected(i, track)
    
    # Add to master list and save
    if newly_selected:
@@ -309,7 +327,11 @@ def select_new_songs(tracks, bucket_name, num_songs=20):
        
    return newly_selected
 
-def scrape_apple_music():
+def scrape_apple_music(on_scraped=None):
+  """Scrape today's New Music Daily playlist and save it to GCS.
+  
+  on_scraped(track) is called for each track as soon as it is scraped.
+  """
   init_gcp()
   url = "https://music.apple.com/az/playlist/new-music-daily/pl.2b0e6e332fdf4b7a91164da3162127b5"
   headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
@@ -367,6 +389,8 @@ def scrape_apple_music():
                       'scrape_date': scrape_date
                   }
                   tracks.append(track_info)
+                  if on_scraped:
+                      on_scraped(track_info)
                   print(f"Scraped {i+1}/{len(playlist_data.get('track', []))}: {track_info['song_name']}")
           
           except Exception as e:
@@ -0,0 +1,241 @@
+"""Offline benchmarks for video_creator.py.
+
+Renders the synthetic songs of render_fixtures.py, with no network and no
+GCS, and times the hot helpers at fixed sizes. Reports frames/s, seconds
+per song and peak memory. Results can be stored as a named baseline and
+compared against later, on the same machine:
+
+    git checkout main && python benchmark_video_creator.py --save-baseline main
+    git checkout my-branch && python benchmark_video_creator.py --compare main
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+from concurrent.futures import ProcessPoolExecutor
+
+# Sets up the offline asset cache, so it comes before video_creator
+import render_fixtures
+from render_fixtures import FIXTURE_SONGS, get_fixture_song, get_fixture_artwork_bytes
+import numpy as np
+import video_creator
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+
+# Fixed sizes for the helpers, the full 9:16 frame and the layout's parts
+HELPER_SIZE = (1080, 1920)
+HELPER_FRAMES = 240
+
+def time_calls(fn, repeat):
+    """Best wall time of repeat calls, in seconds"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def time_frames(draw, size, frames, fps):
+    """Frames/s of draw(region, t) over frames frames"""
+    width, height = size
+    region = np.zeros((height, width, 3), dtype=np.uint8)
+    started = time.perf_counter()
+    for i in range(frames):
+        draw(region, i / fps)
+    return frames / (time.perf_counter() - started)
+
+def benchmark_helpers(repeat=3):
+    """Time the background helpers per call and the per-frame layers in frames/s"""
+    color = (30, 120, 200)
+    fps = video_creator.VIDEO_FPS
+    duration = video_creator.CLIP_DURATION
+    metrics = {
+        'helpers.create_vignette.ms': 1000 * time_calls(
+            lambda: video_creator.create_vignette(HELPER_SIZE, softness=150), repeat
+        ),
+        'helpers.create_highlight_gradient.ms': 1000 * time_calls(
+            lambda: video_creator.create_highlight_gradient(HELPER_SIZE, color), repeat
+        ),
+        'helpers.create_background_array.ms': 1000 * time_calls(
+            lambda: video_creator.create_background_array(HELPER_SIZE, color), repeat
+        ),
+    }
+    
+    scrolling_text = video_creator.create_scrolling_text_layer(
+        text=FIXTURE_SONGS[1]['song_name'],
+        fontsize=80,
+        color='white',
+        font=video_creator.OUTFIT_BOLD,
+        duration=duration,
+        max_width=780,
+        stroke_color='rgba(0,0,0,0.3)',
+        stroke_width=1
+    )
+    metrics['helpers.scrolling_text.fps'] = time_frames(
+        scrolling_text['draw'], (scrolling_text['width'], scrolling_text['height']), HELPER_FRAMES, fps
+    )
+    
+    progress_bar = video_creator.create_progress_bar_layer(
+        video_creator.PROGRESS_BAR_WIDTH, video_creator.PROGRESS_BAR_HEIGHT, color, duration
+    )
+    metrics['helpers.progress_bar.fps'] = time_frames(
+        progress_bar['draw'], (progress_bar['width'], progress_bar['height']), HELPER_FRAMES, fps
+    )
+    
+    # Whole frames of a laid-out song, the per-frame cost of the render
+    background = video_creator.create_background_array(HELPER_SIZE, color)
+    artwork, _ = video_creator.load_artwork(get_fixture_artwork_bytes('large'))
+    render_frame = video_creator.create_song_renderer(
+        get_fixture_song(FIXTURE_SONGS[1], '2026-01-01'), HELPER_SIZE, 1.0,
+        background, artwork, color, True, duration
+    )
+    out = np.empty((HELPER_SIZE[1], HELPER_SIZE[0], 3), dtype=np.uint8)
+    started = time.perf_counter()
+    for i in range(HELPER_FRAMES):
+        render_frame(i / fps, out)
+    metrics['helpers.render_frame.fps'] = HELPER_FRAMES / (time.perf_counter() - started)
+    return metrics
+
+def render_fixture_song(song, index, formats, duration):
+    """Render one song in this (fresh) process and return its measurements"""
+    video_creator.CLIP_DURATION = duration
+    stages = {}
+    started = time.perf_counter()
+    video_creator.generate_music_preview_video(
+        song, index=index, upload=lambda *args, **kwargs: None, formats=formats, stages=stages
+    )
+    seconds = time.perf_counter() - started
+    frames = int(round(duration * video_creator.VIDEO_FPS)) * len(formats)
+    return {
+        'seconds': seconds,
+        'fps': frames / seconds,
+        'peak_rss_mb': video_creator.get_peak_rss_mb(),
+        'stages': {name: stage['wall_seconds'] for name, stage in stages.items()},
+    }
+
+def benchmark_songs(formats, duration):
+    """Render every synthetic song, each in a new process so its peak memory is its own"""
+    date = datetime.datetime.now().strftime("%Y-%m-%d")
+    metrics = {}
+    total = 0.0
+    for index, spec in enumerate(FIXTURE_SONGS):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            song = executor.submit(render_fixture_song, get_fixture_song(spec, date), index, formats, duration).result()
+        total += song['seconds']
+        metrics[f"songs.{spec['key']}.seconds"] = song['seconds']
+        metrics[f"songs.{spec['key']}.fps"] = song['fps']
+        metrics[f"songs.{spec['key']}.peak_rss_mb"] = song['peak_rss_mb']
+        for name, seconds in song['stages'].items():
+            metrics[f"songs.{spec['key']}.stage.{name}.seconds"] = seconds
+    metrics['songs.total.seconds'] = total
+    return metrics
+
+def is_regression(metric, baseline, current, tolerance):
+    """Whether a metric got worse by more than tolerance (a fraction)"""
+    if not baseline:
+        return False
+    if metric.endswith('.fps'):
+        return current < baseline * (1 - tolerance)
+    return current > baseline * (1 + tolerance)
+
+def compare_to_baseline(metrics, baseline, tolerance):
+    """Print every metric next to the baseline, returning the regressed ones.
+    
+    Stage breakdowns are printed but only the headline numbers can regress.
+    """
+    regressions = []
+    for metric in sorted(metrics):
+        current = metrics[metric]
+        previous = baseline['metrics'].get(metric)
+        if previous is None:
+            print(f"{metric:55} {current:10.2f}   (new)")
+            continue
+        change = (current - previous) / previous * 100 if previous else 0.0
+        flag = ''
+        if '.stage.' not in metric and is_regression(metric, previous, current, tolerance):
+            regressions.append(metric)
+            flag = '  REGRESSION'
+        print(f"{metric:55} {current:10.2f}   was {previous:10.2f}   {change:+6.1f}%{flag}")
+    return regressions
+
+def get_machine_info():
+    """What the numbers were measured on, baselines only compare on the same machine"""
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the video renderer offline with synthetic songs")
+    parser.add_argument('--formats', default='story',
+                        help="Comma separated output formats to render each song in")
+    parser.add_argument('--duration', type=float, default=video_creator.CLIP_DURATION,
+                        help="Clip length in seconds, shorter for a quick run")
+    parser.add_argument('--skip-songs', action='store_true',
+                        help="Only time the helpers")
+    parser.add_argument('--save-baseline', metavar='NAME',
+                        help="Store the results as benchmarks/NAME.json")
+    parser.add_argument('--compare', metavar='NAME',
+                        help="Compare against benchmarks/NAME.json and fail on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="How much worse than the baseline a metric may get, as a fraction")
+    args = parser.parse_args()
+    
+    # Long titles only start scrolling after SCROLL_DELAY
+    if args.duration <= video_creator.SCROLL_DELAY:
+        parser.error(f"--duration has to be longer than the {video_creator.SCROLL_DELAY}s before titles scroll")
+
+    formats = [name.strip() for name in args.formats.split(',') if name.strip()]
+    for name in formats:
+        video_creator.get_video_format(name)
+    
+    render_fixtures.use_scratch_dir()
+    render_fixtures.write_fixtures()
+    
+    print("Timing helpers...")
+    metrics = benchmark_helpers()
+    if not args.skip_songs:
+        print(f"Rendering {len(FIXTURE_SONGS)} synthetic songs ({','.join(formats)}, {args.duration:g}s)...")
+        metrics.update(benchmark_songs(formats, args.duration))
+    
+    results = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'formats': formats,
+        'duration': args.duration,
+        'machine': get_machine_info(),
+        'metrics': metrics,
+    }
+    
+    failed = False
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        if baseline['formats'] != formats or baseline['duration'] != args.duration:
+            sys.exit(f"Baseline '{args.compare}' was run with {baseline['formats']} at {baseline['duration']:g}s")
+        if baseline['machine'] != results['machine']:
+            print(f"Warning: baseline '{args.compare}' was measured on {baseline['machine']}")
+        print(f"\nCompared to '{args.compare}' ({baseline['created']}):")
+        regressions = compare_to_baseline(metrics, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+            failed = True
+    else:
+        print("\nResults:")
+        for metric in sorted(metrics):
+            print(f"{metric:55} {metrics[metric]:10.2f}")
+    
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {path}")
+    
+    if failed:
+        sys.exit(1)
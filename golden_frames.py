@@ -0,0 +1,215 @@
+"""Golden-frame regression check for video_creator.py.
+
+Lays out the fixture songs of render_fixtures.py in every output format,
+the same way generate_music_preview_video does, and compares the raw
+frames at fixed timestamps against stored reference PNGs. A frame passes
+if its PSNR and SSIM against the reference clear the thresholds, so a
+faster path that drifts by a few levels of rounding still passes. Failing
+frames get a reference | new | difference image in golden_frames/diffs/.
+Runs offline:
+
+    python golden_frames.py
+
+The references in golden_frames/ are committed, at GOLDEN_SCALE to keep
+them small. Only replace them (--update) for a change meant to alter the
+look. --full-size compares full frames at more timestamps against a set
+kept out of git in golden_frames/full/:
+
+    git checkout main && python golden_frames.py --full-size --update
+    git checkout my-branch && python golden_frames.py --full-size
+"""
+import os
+import sys
+import shutil
+import argparse
+
+# Sets up the offline asset cache, so it comes before video_creator
+import render_fixtures
+from render_fixtures import FIXTURE_SONGS, get_fixture_song
+import numpy as np
+from PIL import Image
+import video_creator
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_frames")
+FULL_SIZE_DIR = os.path.join(GOLDEN_DIR, "full")
+
+# Committed references: still titles and an empty progress bar, then
+# scrolled titles halfway through, shrunk to a quarter of the frame
+GOLDEN_TIMES = [0.0, 9.5]
+GOLDEN_SCALE = 0.25
+
+# Local full-size references: also just before and after the titles start
+# scrolling and the progress bar almost full
+FULL_SIZE_TIMES = [0.0, 2.5, 4.0, 9.5, 14.9]
+
+# A fixed date so the date text never changes
+GOLDEN_DATE = "2026-01-01"
+
+# A frame passes when both hold
+DEFAULT_MIN_PSNR = 40.0
+DEFAULT_MIN_SSIM = 0.99
+
+# Luma SSIM over square windows of this size, constants from Wang et al.
+SSIM_WINDOW = 7
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+def capture_frames(song, index, formats, times):
+    """Render the frames at times for each format, without encoding anything.
+    
+    The stages are timed like render_song does, so the formats' threads
+    time their frames concurrently as in production.
+    """
+    format_by_size = {
+        video_creator.get_video_size(1.0, video_creator.get_video_format(name)['size']): name
+        for name in formats
+    }
+    frames = {}
+    stages = {}
+    
+    def capture(render_frame, output_path, size, *args, **kwargs):
+        frames[format_by_size[tuple(size)]] = {t: render_frame(t).copy() for t in times}
+        # An empty stand-in for the video, whose size the encode stage records
+        open(output_path, 'wb').close()
+        return output_path
+    
+    video_creator.generate_music_preview_video(
+        song, index=index, upload=lambda *args, **kwargs: None, formats=formats, encode=capture, stages=stages
+    )
+    return frames
+
+def shrink_frame(frame, scale):
+    """Frame resized by scale, each pixel the average of the ones it covers"""
+    if scale == 1:
+        return frame
+    image = Image.fromarray(frame)
+    size = (round(image.width * scale), round(image.height * scale))
+    return np.array(image.resize(size, Image.Resampling.BOX))
+
+def get_golden_path(golden_dir, song_key, format_name, t):
+    """Reference PNG of one frame"""
+    return os.path.join(golden_dir, f"{song_key}_{format_name}_{t:05.2f}s.png")
+
+def compute_psnr(reference, frame):
+    """PSNR in dB over all channels, infinite for identical frames"""
+    mse = np.mean((reference.astype(np.float64) - frame.astype(np.float64)) ** 2)
+    if mse == 0:
+        return float('inf')
+    return 10 * np.log10(255.0 ** 2 / mse)
+
+def box_mean(values, window):
+    """Mean of every window x window square (valid positions only)"""
+    summed = np.pad(values, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (
+        summed[window:, window:] - summed[:-window, window:]
+        - summed[window:, :-window] + summed[:-window, :-window]
+    ) / (window * window)
+
+def compute_ssim(reference, frame, window=SSIM_WINDOW):
+    """Mean SSIM of the luma of two RGB frames"""
+    weights = np.array([0.299, 0.587, 0.114])
+    x = reference.astype(np.float64) @ weights
+    y = frame.astype(np.float64) @ weights
+    
+    mean_x = box_mean(x, window)
+    mean_y = box_mean(y, window)
+    var_x = box_mean(x * x, window) - mean_x ** 2
+    var_y = box_mean(y * y, window) - mean_y ** 2
+    covariance = box_mean(x * y, window) - mean_x * mean_y
+    
+    ssim = ((2 * mean_x * mean_y + SSIM_C1) * (2 * covariance + SSIM_C2)) / (
+        (mean_x ** 2 + mean_y ** 2 + SSIM_C1) * (var_x + var_y + SSIM_C2)
+    )
+    return float(ssim.mean())
+
+def write_diff_image(path, reference, frame):
+    """Save reference, new frame and their amplified difference side by side"""
+    difference = np.abs(reference.astype(np.int16) - frame.astype(np.int16)).max(axis=2)
+    # Small drifts are invisible at 1x
+    difference = np.clip(difference * 8, 0, 255).astype(np.uint8)
+    heatmap = np.stack([difference, np.zeros_like(difference), np.zeros_like(difference)], axis=-1)
+    Image.fromarray(np.concatenate([reference, frame, heatmap], axis=1)).save(path)
+
+def check_frame(path, frame, min_psnr, min_ssim, diff_dir):
+    """Compare a frame with its reference, returning an error message or None"""
+    if not os.path.exists(path):
+        return "no reference, run with --update"
+    reference = np.array(Image.open(path).convert('RGB'))
+    if reference.shape != frame.shape:
+        return f"size {frame.shape[1]}x{frame.shape[0]}, reference is {reference.shape[1]}x{reference.shape[0]}"
+    
+    psnr = compute_psnr(reference, frame)
+    ssim = compute_ssim(reference, frame)
+    print(f"  {os.path.basename(path):45} PSNR {psnr:6.2f} dB  SSIM {ssim:.5f}")
+    if psnr >= min_psnr and ssim >= min_ssim:
+        return None
+    
+    os.makedirs(diff_dir, exist_ok=True)
+    diff_path = os.path.join(diff_dir, os.path.basename(path))
+    write_diff_image(diff_path, reference, frame)
+    return f"PSNR {psnr:.2f} dB, SSIM {ssim:.5f}, diff in {diff_path}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare rendered frames against the golden references")
+    parser.add_argument('--update', action='store_true',
+                        help="Store the current frames as the new references")
+    parser.add_argument('--full-size', action='store_true',
+                        help=f"Use the full-size references in {os.path.relpath(FULL_SIZE_DIR)} instead of the committed ones")
+    parser.add_argument('--songs',
+                        help="Comma separated fixture song keys, default all of them")
+    parser.add_argument('--formats', default=','.join(video_creator.VIDEO_FORMATS),
+                        help="Comma separated output formats")
+    parser.add_argument('--min-psnr', type=float, default=DEFAULT_MIN_PSNR,
+                        help="Lowest PSNR in dB a frame may have")
+    parser.add_argument('--min-ssim', type=float, default=DEFAULT_MIN_SSIM,
+                        help="Lowest SSIM a frame may have")
+    args = parser.parse_args()
+    
+    formats = [name.strip() for name in args.formats.split(',') if name.strip()]
+    for name in formats:
+        video_creator.get_video_format(name)
+    specs = FIXTURE_SONGS
+    if args.songs:
+        keys = [key.strip() for key in args.songs.split(',')]
+        specs = [spec for spec in FIXTURE_SONGS if spec['key'] in keys]
+        unknown = set(keys) - {spec['key'] for spec in specs}
+        if unknown:
+            parser.error(f"Unknown fixture songs: {', '.join(sorted(unknown))}")
+    
+    if args.full_size:
+        golden_dir, times, scale = FULL_SIZE_DIR, FULL_SIZE_TIMES, 1
+    else:
+        golden_dir, times, scale = GOLDEN_DIR, GOLDEN_TIMES, GOLDEN_SCALE
+    
+    render_fixtures.use_scratch_dir()
+    render_fixtures.write_fixtures()
+    diff_dir = os.path.join(GOLDEN_DIR, "diffs")
+    if not args.update:
+        shutil.rmtree(diff_dir, ignore_errors=True)
+    
+    failures = []
+    for index, spec in enumerate(specs):
+        print(f"{spec['key']}:")
+        frames = capture_frames(get_fixture_song(spec, GOLDEN_DATE), index, formats, times)
+        for format_name in formats:
+            for t in times:
+                path = get_golden_path(golden_dir, spec['key'], format_name, t)
+                frame = shrink_frame(frames[format_name][t], scale)
+                if args.update:
+                    os.makedirs(golden_dir, exist_ok=True)
+                    Image.fromarray(frame).save(path, optimize=True)
+                    continue
+                error = check_frame(path, frame, args.min_psnr, args.min_ssim, diff_dir)
+                if error:
+                    failures.append((path, error))
+    
+    if args.update:
+        print(f"Stored {len(specs) * len(formats) * len(times)} reference frames in {golden_dir}")
+        sys.exit(0)
+    
+    if failures:
+        print(f"\n{len(failures)} frame(s) differ from the references:")
+        for path, error in failures:
+            print(f"- {os.path.basename(path)}: {error}")
+        sys.exit(1)
+    print("\nEvery frame matches its reference")
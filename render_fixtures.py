@@ -0,0 +1,95 @@
+"""Fixture songs for the offline render tools (benchmark_video_creator.py,
+golden_frames.py).
+
+Import this before video_creator: it points the asset cache at a scratch
+directory that write_fixtures() fills, so nothing is downloaded, and turns
+off the render cache so nothing is looked up in GCS.
+"""
+import os
+import atexit
+import shutil
+import tempfile
+import subprocess
+
+# Render processes inherit the scratch directory through the environment
+if "RENDER_FIXTURE_DIR" not in os.environ:
+    os.environ["RENDER_FIXTURE_DIR"] = tempfile.mkdtemp(prefix="bebop_fixtures_")
+SCRATCH_DIR = os.environ["RENDER_FIXTURE_DIR"]
+os.environ["ASSET_CACHE_DIR"] = os.path.join(SCRATCH_DIR, "assets")
+os.environ["BACKGROUND_CACHE_DIR"] = ""
+os.environ["RENDER_CACHE"] = "0"
+
+import numpy as np
+from PIL import Image
+import video_creator
+from video_encoder import FFMPEG_BINARY
+
+FIXTURE_URL = "https://fixtures.invalid"
+
+# Artwork fixtures, by edge length in pixels
+ARTWORK_FIXTURES = {'small': 600, 'medium': 1400, 'large': 3000}
+PREVIEW_SECONDS = 30
+
+# Short and long (scrolling) titles, a missing preview, dark, light and
+# saturated colors, and non-ASCII text
+FIXTURE_SONGS = [
+    {'key': 'short_title', 'song_name': 'Home', 'artist': 'Mild Orange',
+     'artwork': 'large', 'preview': True, 'color': '#1e78c8'},
+    {'key': 'long_title', 'song_name': 'A Title Long Enough That It Has To Scroll Across The Frame',
+     'artist': 'An Artist Name That Also Runs Long Enough To Scroll', 'artwork': 'large', 'preview': True, 'color': '#c85028'},
+    {'key': 'no_preview', 'song_name': 'Quiet Hours', 'artist': 'Silent Band',
+     'artwork': 'small', 'preview': False, 'color': '#202020'},
+    {'key': 'light_color', 'song_name': 'Pale', 'artist': 'Whiteout',
+     'artwork': 'small', 'preview': True, 'color': '#f0e8d8'},
+    {'key': 'unicode', 'song_name': 'Ünïcødé Títle', 'artist': 'Bjørk & Sigur Rós',
+     'artwork': 'medium', 'preview': True, 'color': '#2e8b57'},
+]
+
+def get_fixture_song(spec, date):
+    """Turn a FIXTURE_SONGS entry into a song record like the spreadsheet's"""
+    return {
+        'song_name': spec['song_name'],
+        'artist': spec['artist'],
+        'artwork_url': f"{FIXTURE_URL}/artwork_{spec['artwork']}.jpg",
+        'preview_url': f"{FIXTURE_URL}/preview.m4a" if spec['preview'] else '',
+        'artwork_bg_color': spec['color'],
+        'selected_date': date,
+    }
+
+def get_fixture_artwork_bytes(name):
+    """Content of a fixture artwork, once write_fixtures() has run"""
+    with open(video_creator.get_asset_path(f"{FIXTURE_URL}/artwork_{name}.jpg"), 'rb') as f:
+        return f.read()
+
+def write_fixtures():
+    """Generate the fixture artwork and preview audio into the asset cache"""
+    os.makedirs(video_creator.ASSET_CACHE_DIR, exist_ok=True)
+    
+    for name, edge in ARTWORK_FIXTURES.items():
+        # A noisy diagonal gradient compresses like a real cover
+        rng = np.random.RandomState(edge)
+        ramp = np.linspace(0, 255, edge, dtype=np.float32)
+        pixels = np.stack([
+            ramp[None, :] * np.ones((edge, 1), dtype=np.float32),
+            ramp[:, None] * np.ones((1, edge), dtype=np.float32),
+            np.full((edge, edge), 128, dtype=np.float32),
+        ], axis=-1)
+        pixels += rng.normal(0, 12, pixels.shape).astype(np.float32)
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode='RGB')
+        image.save(video_creator.get_asset_path(f"{FIXTURE_URL}/artwork_{name}.jpg"), quality=90)
+    
+    # A beeping tone, encoded like the real AAC previews
+    subprocess.run([
+        FFMPEG_BINARY, '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f"sine=frequency=440:beep_factor=2:duration={PREVIEW_SECONDS}",
+        '-ac', '2', '-ar', '44100', '-c:a', 'aac', '-b:a', '256k',
+        video_creator.get_asset_path(f"{FIXTURE_URL}/preview.m4a")
+    ], check=True)
+
+def use_scratch_dir():
+    """Work in the scratch directory, so rendered files stay out of the repo.
+    
+    It is removed when the script exits.
+    """
+    atexit.register(shutil.rmtree, SCRATCH_DIR, True)
+    os.chdir(SCRATCH_DIR)
@@ -1,6 +1,5 @@
-from moviepy.editor import *
 import requests
-from PIL import Image, ImageDraw, ImageFilter, ImageEnhance
+from PIL import Image, ImageDraw, ImageFilter, ImageEnhance, ImageFont, ImageColor
 import os
 import numpy as np
 import colorsys
@@ -8,14 +7,147 @@ import tempfile
 import datetime
 import shutil
 import json
+import math
+import time
+import hashlib
+import argparse
+import traceback
+import queue
+import threading
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import functools
+import contextlib
+from collections import OrderedDict
 from google.cloud import storage
 import io
 import gspread
 from google.oauth2 import service_account
+from video_encoder import (
+    encode_frames, encode_rendered_frames, concat_videos, decode_audio, apply_audio_fades,
+    AUDIO_SAMPLE_RATE, AUDIO_CHANNELS, DEFAULT_ENCODER_PROFILE
+)
 
 # Set environment for headless execution
 os.environ["IMAGEIO_FFMPEG_EXE"] = "ffmpeg"
 
+# Background cache settings. Bump BACKGROUND_VERSION whenever the look of
+# create_background_array changes so stale files on disk are not reused.
+BACKGROUND_VERSION = 1
+BACKGROUND_CACHE_SIZE = int(os.environ.get("BACKGROUND_CACHE_SIZE", "16"))
+BACKGROUND_CACHE_DIR = os.environ.get("BACKGROUND_CACHE_DIR", "")
+# The disk cache is pruned, least recently used first, to stay under this size
+BACKGROUND_CACHE_MAX_MB = int(os.environ.get("BACKGROUND_CACHE_MAX_MB", "256"))
+BACKGROUND_COLOR_STEP = int(os.environ.get("BACKGROUND_COLOR_STEP", "4"))
+
+_background_cache = OrderedDict()
+_background_cache_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+# Layers that look the same for every song are built once per process and
+# reused. Bump TEMPLATE_VERSION whenever one of the template builders changes.
+TEMPLATE_VERSION = 1
+
+_template_assets = {}
+
+# Set font paths - for GitHub Actions, use fonts in the repository
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+OUTFIT_BOLD = f"{FONT_DIR}/Outfit-Bold.ttf"
+OUTFIT_SEMIBOLD = f"{FONT_DIR}/Outfit-SemiBold.ttf"
+OUTFIT_MEDIUM = f"{FONT_DIR}/Outfit-Medium.ttf"
+OUTFIT_REGULAR = f"{FONT_DIR}/Outfit-Regular.ttf"
+
+# Template layout constants
+CLIP_DURATION = 15
+VIDEO_FPS = 24
+
+# Artwork and preview downloads. Everything for the day is fetched
+# concurrently up front into ASSET_CACHE_DIR so renders start with local files.
+ASSET_CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "bebop_assets"))
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "8"))
+DOWNLOAD_TIMEOUT = (5, 30)  # Connect, read
+DOWNLOAD_RETRIES = 3
+
+_http_session = {'pid': None, 'session': None}
+
+# Output formats. Each is a frame size plus the scale the 9:16 layout is
+# drawn at so it fits, and the folder under videos/{date}/ it goes in.
+# OUTPUT_FORMATS lists the ones to render, sharing one job per song.
+VIDEO_FORMATS = {
+    'story': {'aspect': '9:16', 'size': (1080, 1920), 'scale': 1.0, 'folder': 'individual'},
+    'portrait': {'aspect': '4:5', 'size': (1080, 1350), 'scale': 0.75, 'folder': 'portrait'},
+    'square': {'aspect': '1:1', 'size': (1080, 1080), 'scale': 0.6, 'folder': 'square'},
+}
+OUTPUT_FORMATS = [name.strip() for name in os.environ.get("OUTPUT_FORMATS", "story").split(',') if name.strip()]
+
+# Long titles and artist names hold still this long, in seconds, then scroll
+SCROLL_DELAY = 3
+
+# Draft renders for layout QA: same layout at a fraction of the size and
+# fps, never uploaded. DRAFT_DURATION empty means the full clip length, and
+# it has to be longer than SCROLL_DELAY so long titles still scroll.
+DRAFT_SCALE = float(os.environ.get("DRAFT_SCALE", "0.5"))
+DRAFT_FPS = int(os.environ.get("DRAFT_FPS", "12"))
+DRAFT_DURATION = os.environ.get("DRAFT_DURATION", "")
+DRAFT_ENCODER_PROFILE = "fast-draft"
+
+# Skip songs whose uploaded video was rendered from identical inputs
+RENDER_CACHE = os.environ.get("RENDER_CACHE", "1") == "1"
+FINGERPRINT_METADATA_KEY = "render_fingerprint"
+
+# Per-date record of which songs finished, so a rerun only renders the rest.
+# Kept in MANIFEST_DIR and next to the day's videos in GCS.
+MANIFEST_DIR = os.environ.get("MANIFEST_DIR", os.path.join("video_output", "manifests"))
+
+# Overlap frame rendering and encoding on separate threads
+RENDER_PIPELINE = os.environ.get("RENDER_PIPELINE", "1") == "1"
+
+# Finished videos upload on a thread pool while the next songs render.
+# Objects are created public so no separate make_public pass is needed.
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "4"))
+UPLOAD_ACL = "publicRead"
+
+_storage_client = {'pid': None, 'client': None}
+
+# Stitched reels made by a combined render: name and number of songs (None
+# is all of them). Same names as video_stitcher.py uses, but they stay local.
+STITCHED_REELS = [('60s', 4), ('90s', 6), ('full', None)]
+
+# Songs select_new_songs picks per day when rendering follows the selection
+SELECTION_SIZE = 20
+
+# Parallel rendering of a batch. RENDER_WORKERS empty means pick a worker
+# count from the available cores and memory, 1 renders songs one by one.
+RENDER_WORKERS = os.environ.get("RENDER_WORKERS", "")
+RENDER_WORKER_MEMORY_MB = int(os.environ.get("RENDER_WORKER_MEMORY_MB", "700"))
+
+# Streaming renders keep as little as possible in memory per song: formats
+# are laid out and encoded one after another through STREAMING_BUFFERS frame
+# buffers, and only the current background is kept. RENDER_MEMORY_BUDGET_MB
+# (peak RSS, ffmpeg included) then caps how many songs render at once.
+# Empty means no budget and the normal render.
+RENDER_MEMORY_BUDGET_MB = os.environ.get("RENDER_MEMORY_BUDGET_MB", "")
+STREAMING_BUFFERS = 2
+
+# Stages of a song's render that are timed, in the order they run
+RENDER_STAGES = ['download', 'audio', 'background', 'artwork', 'text', 'compose', 'encode', 'upload']
+_stage_lock = threading.Lock()
+
+# A stage's peak RSS is the largest of the readings taken this often while
+# it runs (see open_rss_window)
+RSS_SAMPLE_SECONDS = 0.05
+# Open windows by id(): equal-looking windows of different threads must
+# never be mistaken for each other
+_rss_sampler = {'pid': None, 'windows': {}}
+_rss_lock = threading.Lock()
+ARTWORK_SIZE = 800
+ARTWORK_RADIUS = 25  # Corner radius
+PROGRESS_BAR_WIDTH = 800
+PROGRESS_BAR_HEIGHT = 6
+
 def init_gcp():
     """Initialize GCP credentials"""
     service_account_json = os.environ.get('GCP_SA_KEY')
@@ -23,50 +155,176 @@ def init_gcp():
         f.write(service_account_json)
     os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'gcp_credentials.json'
 
-def upload_video_to_gcs(local_path, bucket_name, destination_blob_name):
-    """Upload video to GCS bucket"""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+def get_storage_client():
+    """Get this process's shared GCS client"""
+    # Clients aren't shared across forked render workers
+    if _storage_client['pid'] != os.getpid():
+        _storage_client['client'] = storage.Client()
+        _storage_client['pid'] = os.getpid()
+    return _storage_client['client']
+
+def upload_video_to_gcs(local_path, bucket_name, destination_blob_name, metadata=None):
+    """Upload video to GCS bucket, publicly readable from the start"""
+    bucket = get_storage_client().bucket(bucket_name)
     blob = bucket.blob(destination_blob_name)
-    blob.upload_from_filename(local_path)
+    if metadata:
+        blob.metadata = metadata
+    blob.upload_from_filename(local_path, predefined_acl=UPLOAD_ACL)
     print(f"File {local_path} uploaded to gs://{bucket_name}/{destination_blob_name}.")
 
+def get_uploaded_fingerprint(bucket_name, blob_name):
+    """Return the render fingerprint stored on an uploaded video, if any"""
+    try:
+        blob = get_storage_client().bucket(bucket_name).get_blob(blob_name)
+    except Exception as e:
+        print(f"Could not check gs://{bucket_name}/{blob_name}: {e}")
+        return None
+    if blob is None or not blob.metadata:
+        return None
+    return blob.metadata.get(FINGERPRINT_METADATA_KEY)
+
+def get_http_session():
+    """Get this process's pooled HTTP session, retrying transient failures"""
+    # Sessions aren't shared across forked render workers
+    if _http_session['pid'] != os.getpid():
+        retry = Retry(
+            total=DOWNLOAD_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=['GET']
+        )
+        adapter = HTTPAdapter(pool_connections=PREFETCH_WORKERS, pool_maxsize=PREFETCH_WORKERS, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _http_session['pid'] = os.getpid()
+        _http_session['session'] = session
+    return _http_session['session']
+
+def get_asset_path(url):
+    """Local cache path for a downloaded asset"""
+    extension = os.path.splitext(url.split('?')[0])[1][:8]
+    return os.path.join(ASSET_CACHE_DIR, hashlib.sha256(url.encode('utf-8')).hexdigest() + extension)
+
+def write_atomically(path, write):
+    """Create or replace the file at path through write(f), with f open for
+    binary writing. The data goes to a temporary file that is renamed into
+    place, so a half-written file is never picked up, even if the process
+    is killed."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with open(partial_path, 'wb') as f:
+            write(f)
+        os.replace(partial_path, path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+def download_asset(url):
+    """Download a URL into the asset cache (once) and return the local path"""
+    path = get_asset_path(url)
+    if os.path.exists(path):
+        return path
+    
+    response = get_http_session().get(url, timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    
+    write_atomically(path, lambda f: f.write(response.content))
+    return path
+
+def fetch_asset_bytes(url):
+    """Get an asset's content, from the prefetch cache when possible"""
+    with open(download_asset(url), 'rb') as f:
+        return f.read()
+
+def prefetch_song_assets(songs):
+    """Download every song's artwork and preview audio concurrently"""
+    urls = []
+    for song in songs:
+        for key in ('artwork_url', 'preview_url'):
+            url = (song.get(key) or '').strip()
+            if url and url not in urls:
+                urls.append(url)
+    
+    if not urls:
+        return {}
+    
+    failures = {}
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+        futures = {executor.submit(download_asset, url): url for url in urls}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failures[futures[future]] = str(e)
+    
+    print(f"Prefetched {len(urls) - len(failures)}/{len(urls)} assets into {ASSET_CACHE_DIR}")
+    for url, error in failures.items():
+        # The render will retry this one and handle it like before
+        print(f"Prefetch failed for {url}: {error}")
+    return failures
+
 def hex_to_rgb(hex_color):
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
-def create_vignette(size, intensity=0.25):
+def scale_px(value, scale=1.0):
+    """Scale a full-size pixel measure, keeping it at least one pixel"""
+    return max(1, int(round(value * scale)))
+
+def get_video_size(scale=1.0, size=(1080, 1920)):
+    """Output size for a scale, kept even for yuv420p"""
+    width, height = size
+    return scale_px(width, scale) // 2 * 2, scale_px(height, scale) // 2 * 2
+
+def get_video_format(name):
+    """Look up an output format by name"""
+    if name not in VIDEO_FORMATS:
+        raise ValueError(f"Unknown output format '{name}'. Available: {', '.join(VIDEO_FORMATS)}")
+    return VIDEO_FORMATS[name]
+
+def get_video_blob_name(date, filename, format_name='story'):
+    """GCS path of a song's video in one output format"""
+    return f"videos/{date}/{get_video_format(format_name)['folder']}/{filename}"
+
+def get_draft_settings():
+    """Scale, fps and duration of a draft render"""
+    duration = float(DRAFT_DURATION) if DRAFT_DURATION else CLIP_DURATION
+    if duration <= SCROLL_DELAY:
+        raise ValueError(f"DRAFT_DURATION has to be longer than the {SCROLL_DELAY}s before long titles scroll, got {DRAFT_DURATION}")
+    return {
+        'scale': DRAFT_SCALE,
+        'fps': DRAFT_FPS,
+        'duration': duration,
+    }
+
+def create_vignette(size, intensity=0.25, softness=0):
     """Create a very subtle vignette mask"""
     width, height = size
-    mask = Image.new('L', (width, height), 255)
-    draw = ImageDraw.Draw(mask)
     
     # Calculate gradient parameters
     min_dim = min(width, height)
     center_x, center_y = width/2, height/2
     radius = min_dim * 0.9  # Very large radius for subtle effect
     
-    # Draw radial gradient
-    for y in range(height):
-        for x in range(width):
-            # Distance from center
-            distance = ((x - center_x) ** 2 + (y - center_y) ** 2) ** 0.5
-            # Calculate gradient factor
-            factor = min(1.0, distance / radius)
-            # Apply intensity (very low intensity)
-            factor = factor ** intensity
-            # Set pixel value (only slightly darker at edges)
-            value = int(255 * (1 - factor * 0.4))  # Only darken by 40% max
-            mask.putpixel((x, y), value)
+    # Distance from center for the whole mask at once. A non-zero softness
+    # rounds off the peak in the middle the same way a large blur would.
+    y = np.arange(height, dtype=np.float32)[:, None]
+    x = np.arange(width, dtype=np.float32)[None, :]
+    distance = np.sqrt((x - center_x) ** 2 + (y - center_y) ** 2 + softness ** 2)
     
-    return mask
-
-def create_highlight_gradient(size, base_color):
-    """Create a gradient with subtle highlight effect"""
-    width, height = size
-    img = Image.new('RGB', (width, height))
-    draw = ImageDraw.Draw(img)
+    # Calculate gradient factor and apply intensity (very low intensity)
+    factor = np.minimum(1.0, distance / radius) ** intensity
+    
+    # Only slightly darker at edges - darken by 40% max
+    values = (255 * (1 - factor * 0.4)).astype(np.uint8)
     
+    return Image.fromarray(values, mode='L')
+
+def get_highlight_colors(base_color):
+    """Get the top, middle and bottom colors of the highlight gradient"""
     # Convert base color to HSV
     r, g, b = base_color
     h, s, v = colorsys.rgb_to_hsv(r/255.0, g/255.0, b/255.0)
@@ -93,205 +351,593 @@ def create_highlight_gradient(size, base_color):
     mid_color = (int(mid_r*255), int(mid_g*255), int(mid_b*255))
     bottom_color = (int(bottom_r*255), int(bottom_g*255), int(bottom_b*255))
     
-    # Draw gradient with highlight in upper third
-    for y in range(height):
-        # Position ratio
-        ratio = y / height
-        
-        if ratio < 0.33:  # Top third - transition from bright to base
-            sub_ratio = ratio / 0.33
-            r = int(top_color[0] * (1 - sub_ratio) + mid_color[0] * sub_ratio)
-            g = int(top_color[1] * (1 - sub_ratio) + mid_color[1] * sub_ratio)
-            b = int(top_color[2] * (1 - sub_ratio) + mid_color[2] * sub_ratio)
-        else:  # Bottom two-thirds - transition from base to darker
-            sub_ratio = (ratio - 0.33) / 0.67
-            r = int(mid_color[0] * (1 - sub_ratio) + bottom_color[0] * sub_ratio)
-            g = int(mid_color[1] * (1 - sub_ratio) + bottom_color[1] * sub_ratio)
-            b = int(mid_color[2] * (1 - sub_ratio) + bottom_color[2] * sub_ratio)
-            
-        draw.line([(0, y), (width, y)], fill=(r, g, b))
-    
-    return img
-
-def create_scrolling_text_clip(text, font, fontsize, color, duration, max_width, stroke_color=None, stroke_width=0):
-    """Create a text clip that scrolls horizontally if too long for max_width"""
-    # First create a static text clip to get its dimensions
-    static_clip = TextClip(
-        txt=text,
-        fontsize=fontsize,
-        color=color,
-        font=font,
-        method='label',
-        stroke_color=stroke_color,
-        stroke_width=stroke_width
-    ).set_duration(duration)
-    
-    # If text fits within max_width, return the static clip
-    if static_clip.size[0] <= max_width:
-        return static_clip
-    
-    # Text is too long, need to create scrolling effect
-    def make_frame(t):
-        # Add padding between repeated text
-        scroll_text = text + "   " + text
-        
-        # Create the frame with the full text
-        txt_frame = TextClip(
-            txt=scroll_text,
-            fontsize=fontsize,
-            color=color,
-            font=font,
-            method='label',
-            stroke_color=stroke_color,
-            stroke_width=stroke_width
-        ).get_frame(0)
-        
-        # Calculate total scroll distance
-        total_text_width = static_clip.size[0] + 100  # Add a little extra space
-        
-        # Calculate scroll speed - complete one full cycle in duration seconds
-        # For a smoother feel, we'll use 3 seconds delay before starting scroll
-        delay = 3
+    return top_color, mid_color, bottom_color
+
+def create_highlight_gradient_array(size, base_color):
+    """Create the highlight gradient as an (height, width, 3) uint8 array"""
+    width, height = size
+    top_color, mid_color, bottom_color = get_highlight_colors(base_color)
+    top_color = np.array(top_color, dtype=np.float64)
+    mid_color = np.array(mid_color, dtype=np.float64)
+    bottom_color = np.array(bottom_color, dtype=np.float64)
+    
+    # Position ratio of every row
+    ratio = (np.arange(height, dtype=np.float64) / height)[:, None]
+    
+    # Top third - transition from bright to base,
+    # bottom two-thirds - transition from base to darker
+    top_ratio = ratio / 0.33
+    bottom_ratio = (ratio - 0.33) / 0.67
+    rows = np.where(
+        ratio < 0.33,
+        top_color * (1 - top_ratio) + mid_color * top_ratio,
+        mid_color * (1 - bottom_ratio) + bottom_color * bottom_ratio
+    ).astype(np.uint8)
+    
+    # Every row is a single color, so just repeat it across the width
+    return np.ascontiguousarray(np.broadcast_to(rows[:, None, :], (height, width, 3)))
+
+def create_highlight_gradient(size, base_color):
+    """Create a gradient with subtle highlight effect"""
+    return Image.fromarray(create_highlight_gradient_array(size, base_color), mode='RGB')
+
+def create_background_array(size, base_color, vignette_intensity=0.2):
+    """Create the gradient background with vignette as an (height, width, 3) uint8 array"""
+    gradient = create_highlight_gradient_array(size, base_color).astype(np.uint16)
+    
+    # Soft analytic vignette instead of a radius-150 blur of a hard one,
+    # the softness is relative to the full 1080px width
+    softness = 150 * size[0] / 1080
+    vignette = np.asarray(create_vignette(size, vignette_intensity, softness=softness), dtype=np.uint16)
+    
+    # Same as compositing the gradient over black through the vignette mask
+    background = (gradient * vignette[:, :, None] + 127) // 255
+    return background.astype(np.uint8)
+
+def quantize_color(color, step=BACKGROUND_COLOR_STEP):
+    """Round each RGB channel to the nearest multiple of step"""
+    if step <= 1:
+        return tuple(color)
+    return tuple(min(255, int(round(c / step)) * step) for c in color)
+
+def get_cached_background(size, base_color, cache_size=None):
+    """Get the background array for a color and size, building it only on a cache miss.
+    
+    cache_size overrides BACKGROUND_CACHE_SIZE for how many stay in memory.
+    """
+    width, height = size
+    color = quantize_color(base_color)
+    key = (color, width, height)
+    
+    # In-memory LRU first
+    if key in _background_cache:
+        _background_cache.move_to_end(key)
+        _background_cache_stats['hits'] += 1
+        return _background_cache[key]
+    
+    # Then the optional on-disk cache, which survives reruns of the same day
+    cache_path = None
+    background = None
+    if BACKGROUND_CACHE_DIR:
+        color_hex = '%02x%02x%02x' % color
+        cache_path = os.path.join(
+            BACKGROUND_CACHE_DIR,
+            f"bg_v{BACKGROUND_VERSION}_{width}x{height}_{color_hex}.npy"
+        )
+        if os.path.exists(cache_path):
+            try:
+                background = np.load(cache_path)
+                _background_cache_stats['disk_hits'] += 1
+                # Mark it recently used for prune_background_cache
+                os.utime(cache_path)
+            except Exception as e:
+                print(f"Error reading cached background {cache_path}: {e}")
+                background = None
+    
+    if background is None:
+        _background_cache_stats['misses'] += 1
+        background = create_background_array(size, color)
+        if cache_path:
+            try:
+                write_atomically(cache_path, lambda f: np.save(f, background))
+                prune_background_cache()
+            except Exception as e:
+                print(f"Error writing cached background {cache_path}: {e}")
+    
+    # Shared between renders, so make sure nobody draws on it
+    background.flags.writeable = False
+    _background_cache[key] = background
+    if cache_size is None:
+        cache_size = BACKGROUND_CACHE_SIZE
+    while len(_background_cache) > max(1, cache_size):
+        _background_cache.popitem(last=False)
+    
+    return background
+
+def prune_background_cache(max_mb=None):
+    """Delete the least recently used backgrounds on disk until the cache fits in max_mb"""
+    if max_mb is None:
+        max_mb = BACKGROUND_CACHE_MAX_MB
+    entries = []
+    for name in os.listdir(BACKGROUND_CACHE_DIR):
+        if not name.endswith('.npy'):
+            continue
+        path = os.path.join(BACKGROUND_CACHE_DIR, name)
+        try:
+            info = os.stat(path)
+        except OSError:
+            # Pruned by another worker
+            continue
+        entries.append((info.st_mtime, info.st_size, path))
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_mb * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+def get_background_cache_stats():
+    """Return background cache hit/miss counters"""
+    stats = dict(_background_cache_stats)
+    stats['size'] = len(_background_cache)
+    return stats
+
+def parse_color(color):
+    """Convert a color name, hex string, 'rgba(r,g,b,a)' string or tuple to an RGBA tuple"""
+    if color is None:
+        return (0, 0, 0, 0)
+    if isinstance(color, (tuple, list)):
+        return tuple(color) + (255,) * (4 - len(color))
+    
+    color = color.strip().lower()
+    if color == 'transparent':
+        return (0, 0, 0, 0)
+    if color.startswith('rgba(') and color.endswith(')'):
+        # CSS style alpha between 0 and 1, as used with ImageMagick before
+        r, g, b, a = [part.strip() for part in color[5:-1].split(',')]
+        return (int(r), int(g), int(b), int(round(float(a) * 255)))
+    
+    rgb = ImageColor.getrgb(color)
+    return tuple(rgb) + (255,) * (4 - len(rgb))
+
+@functools.lru_cache(maxsize=None)
+def get_font(font, fontsize):
+    """Load a TrueType font once per path and size"""
+    return ImageFont.truetype(font, fontsize)
+
+def get_text_layout(text, font, fontsize, stroke_width=0):
+    """Get the (width, height) of rendered text and the origin to draw it at"""
+    pil_font = get_font(font, fontsize)
+    ascent, descent = pil_font.getmetrics()
+    left, _, right, _ = pil_font.getbbox(text, anchor='la', stroke_width=stroke_width)
+    
+    # Use the advance width so trailing spaces count, like ImageMagick labels
+    left = min(0, left)
+    right = max(right, math.ceil(pil_font.getlength(text)) + stroke_width)
+    
+    width = max(1, right - left)
+    height = ascent + descent + 2 * stroke_width
+    return (width, height), (-left, stroke_width)
+
+def measure_text(text, font, fontsize, stroke_width=0):
+    """Measure text without rendering it"""
+    size, _ = get_text_layout(text, font, fontsize, stroke_width)
+    return size
+
+@functools.lru_cache(maxsize=256)
+def render_text(text, font, fontsize, color='white', stroke_color=None, stroke_width=0):
+    """Render a single line of text to an (height, width, 4) RGBA uint8 array"""
+    (width, height), origin = get_text_layout(text, font, fontsize, stroke_width)
+    pil_font = get_font(font, fontsize)
+    
+    # Glyph coverage for the fill, and for fill plus outline
+    fill_mask = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(fill_mask).text(origin, text, font=pil_font, fill=255, anchor='la')
+    fill_cov = np.asarray(fill_mask, dtype=np.float32) / 255.0
+    
+    fill_rgba = np.array(parse_color(color), dtype=np.float32)
+    fill_alpha = fill_cov * (fill_rgba[3] / 255.0)
+    
+    if stroke_color is not None and stroke_width > 0:
+        stroke_mask = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(stroke_mask).text(
+            origin, text, font=pil_font, fill=255, anchor='la',
+            stroke_width=stroke_width, stroke_fill=255
+        )
+        stroke_cov = np.asarray(stroke_mask, dtype=np.float32) / 255.0
+        stroke_rgba = np.array(parse_color(stroke_color), dtype=np.float32)
+        stroke_alpha = stroke_cov * (stroke_rgba[3] / 255.0)
+    else:
+        stroke_rgba = np.zeros(4, dtype=np.float32)
+        stroke_alpha = np.zeros_like(fill_alpha)
+    
+    # Fill drawn over the outline
+    alpha = fill_alpha + stroke_alpha * (1 - fill_alpha)
+    rgb = (
+        fill_rgba[:3] * fill_alpha[:, :, None]
+        + stroke_rgba[:3] * (stroke_alpha * (1 - fill_alpha))[:, :, None]
+    ) / np.maximum(alpha, 1e-6)[:, :, None]
+    
+    rendered = np.dstack([rgb, alpha * 255.0])
+    rendered = np.clip(np.rint(rendered), 0, 255).astype(np.uint8)
+    
+    # Cached and shared between clips, so make sure nobody draws on it
+    rendered.flags.writeable = False
+    return rendered
+
+def get_template_asset(name, builder, scale=1.0):
+    """Get a song-invariant layer, building it on first use for the current template version and scale"""
+    key = (TEMPLATE_VERSION, name, scale)
+    if key not in _template_assets:
+        _template_assets[key] = builder(scale)
+    return _template_assets[key]
+
+def build_artwork_mask(scale=1.0):
+    """Build the rounded-corner mask for the artwork"""
+    artwork_size = scale_px(ARTWORK_SIZE, scale)
+    mask = Image.new('L', (artwork_size, artwork_size), 0)
+    
+    # Draw the rounded rectangle on the mask
+    draw = ImageDraw.Draw(mask)
+    draw.rounded_rectangle(
+        [(0, 0), (artwork_size - 1, artwork_size - 1)],
+        radius=scale_px(ARTWORK_RADIUS, scale),
+        fill=255
+    )
+    return mask
+
+def build_artwork_shadow(scale=1.0):
+    """Build the soft drop shadow that sits under the artwork as an RGBA array"""
+    artwork_size = scale_px(ARTWORK_SIZE, scale)
+    margin = scale_px(30, scale)
+    
+    # Create a subtle drop shadow
+    shadow = Image.new('RGBA', (artwork_size + 2 * margin, artwork_size + 2 * margin), (0, 0, 0, 0))
+    shadow_draw = ImageDraw.Draw(shadow)
+    
+    # Draw bottom shadow with reduced opacity
+    shadow_draw.rounded_rectangle([
+        (margin, margin + artwork_size - scale_px(20, scale)),
+        (artwork_size + margin, artwork_size + scale_px(40, scale))
+    ], radius=scale_px(ARTWORK_RADIUS, scale), fill=(0, 0, 0, 40))
+    
+    # Add blur for softer shadow
+    shadow = shadow.filter(ImageFilter.GaussianBlur(radius=30 * scale))
+    
+    return np.array(shadow)
+
+def build_header_text(scale=1.0):
+    """Build the "NEW MUSIC TODAY" header text as an RGBA array"""
+    # Made bolder with semibold font
+    return render_text(
+        "NEW MUSIC TODAY",
+        font=OUTFIT_SEMIBOLD,  # Changed to semibold for more emphasis
+        fontsize=scale_px(42, scale),
+        color='white',
+        stroke_color='rgba(0,0,0,0.3)',
+        stroke_width=scale_px(1, scale)
+    )
+
+def build_progress_bg(scale=1.0):
+    """Build the grey track behind the progress bar"""
+    return np.full((scale_px(PROGRESS_BAR_HEIGHT, scale), scale_px(PROGRESS_BAR_WIDTH, scale), 3), 50, dtype=np.uint8)
+
+def create_image_layer(image):
+    """Create a static layer from an RGB or RGBA uint8 array"""
+    height, width = image.shape[:2]
+    alpha = None
+    if image.ndim == 3 and image.shape[2] == 4:
+        alpha = image[:, :, 3].astype(np.float32) / 255.0
+        image = image[:, :, :3]
+    return {'image': image, 'alpha': alpha, 'draw': None, 'width': width, 'height': height, 'x': 0, 'y': 0}
+
+def create_dynamic_layer(width, height, draw):
+    """Create a layer that is redrawn every frame by draw(region, t)"""
+    return {'image': None, 'alpha': None, 'draw': draw, 'width': width, 'height': height, 'x': 0, 'y': 0}
+
+def set_layer_position(layer, x, y):
+    """Place a layer on the frame, rounding down like MoviePy does"""
+    layer['x'] = int(x)
+    layer['y'] = int(y)
+    return layer
+
+def blit_layer(frame, image, alpha, x, y):
+    """Alpha-blend an image onto frame in place at (x, y), clipping to the frame"""
+    frame_h, frame_w = frame.shape[:2]
+    h, w = image.shape[:2]
+    
+    # Visible part of the image on the frame
+    x1, y1 = max(0, -x), max(0, -y)
+    x2, y2 = min(w, frame_w - x), min(h, frame_h - y)
+    if x1 >= x2 or y1 >= y2:
+        return frame
+    
+    region = frame[y + y1:y + y2, x + x1:x + x2]
+    if alpha is None:
+        region[...] = image[y1:y2, x1:x2]
+    else:
+        a = alpha[y1:y2, x1:x2, None]
+        region[...] = (a * image[y1:y2, x1:x2] + (1.0 - a) * region).astype(np.uint8)
+    return frame
+
+def create_scrolling_text_layer(text, font, fontsize, color, duration, max_width, stroke_color=None, stroke_width=0, scroll_gap=100):
+    """Create a text layer that scrolls horizontally if too long for max_width"""
+    # First measure the text to get its dimensions
+    text_width, _ = measure_text(text, font, fontsize, stroke_width)
+    
+    # If text fits within max_width, return a static layer
+    if text_width <= max_width:
+        return create_image_layer(render_text(text, font, fontsize, color, stroke_color, stroke_width))
+    
+    # Text is too long, need to create scrolling effect.
+    # Add padding between repeated text
+    scroll_text = text + "   " + text
+    
+    # Rasterize the full strip once - every frame is just a slice of it
+    strip = render_text(scroll_text, font, fontsize, color, stroke_color, stroke_width)
+    txt_frame = strip[:, :, :3]
+    txt_alpha = strip[:, :, 3].astype(np.float32) / 255.0
+    
+    # Calculate total scroll distance
+    total_text_width = text_width + scroll_gap  # Add a little extra space
+    
+    # Calculate scroll speed - complete one full cycle in duration seconds
+    # For a smoother feel, we'll wait SCROLL_DELAY before starting scroll
+    delay = SCROLL_DELAY
+    scroll_duration = duration - delay
+    scroll_speed = total_text_width / scroll_duration
+    w = max_width
+    
+    def draw(region, t):
         if t < delay:
             offset = 0
         else:
             # Scroll one text width over the remaining duration
-            scroll_duration = duration - delay
-            scroll_speed = total_text_width / scroll_duration
             offset = ((t - delay) * scroll_speed) % total_text_width
         
-        # Create a frame showing just the visible portion
-        h, w = static_clip.size[1], max_width
+        # Show just the visible portion
         x1, x2 = int(offset), int(offset) + w
         
         # Make sure we don't go out of bounds
         if x2 > txt_frame.shape[1]:
-            return txt_frame[:, 0:w]
+            x1, x2 = 0, w
         
-        return txt_frame[:, x1:x2]
+        blit_layer(region, txt_frame[:, x1:x2], txt_alpha[:, x1:x2], 0, 0)
     
-    # Create and return the scrolling clip
-    scrolling_clip = VideoClip(make_frame=make_frame, duration=duration)
-    return scrolling_clip
+    return create_dynamic_layer(max_width, strip.shape[0], draw)
 
+def get_progress_color(base_color):
+    """Get the bright progress bar color for a background color"""
+    r, g, b = base_color
+    h, s, v = colorsys.rgb_to_hsv(r/255.0, g/255.0, b/255.0)
+    
+    # Ensure high brightness for better contrast
+    bright_h = h
+    bright_s = max(0.4, min(0.9, s))
+    bright_v = max(0.85, min(1.0, v * 1.5))
+    
+    # Convert to RGB
+    bright_r, bright_g, bright_b = colorsys.hsv_to_rgb(bright_h, bright_s, bright_v)
+    return (int(min(255, bright_r*255)), int(min(255, bright_g*255)), int(min(255, bright_b*255)))
 
-def generate_music_preview_video(song_data, index=0):
-    """Generate a music preview video for a single song"""
-    # Create a temp directory for our working files
-    temp_dir = tempfile.mkdtemp()
+def create_progress_bar_layer(width, height, color, duration):
+    """Create the animated progress bar layer"""
+    color = np.array(color, dtype=np.uint8)
     
-    try:
-        # Video dimensions
-        width, height = 1080, 1920
-        clip_duration = 15
+    def draw(region, t):
+        progress_width = int(width * (t / duration))
         
-        # Check if preview_url exists and is not empty
-        audio_url = song_data.get('preview_url', '').strip()
-        has_audio = bool(audio_url)
+        # Fill progress portion, the rest of the bar stays dark
+        region[:, :progress_width] = color
+        region[:, progress_width:] = 0
+    
+    return create_dynamic_layer(width, height, draw)
+
+def create_frame_renderer(size, layers):
+    """Flatten the static layers once and return render_frame(t, out=None).
+    
+    Each frame starts from a copy of the flattened base, and only the
+    rectangles of the dynamic layers are redrawn. Dynamic layers are
+    assumed not to overlap each other.
+    """
+    width, height = size
+    base = np.zeros((height, width, 3), dtype=np.uint8)
+    dynamic = []
+    
+    for i, layer in enumerate(layers):
+        if layer['draw'] is None:
+            blit_layer(base, layer['image'], layer['alpha'], layer['x'], layer['y'])
+            continue
         
-        if has_audio:
-            try:
-                # Download and prepare audio
-                audio_response = requests.get(audio_url)
-                audio_path = os.path.join(temp_dir, 'preview_audio.m4a')
-                with open(audio_path, 'wb') as f:
-                    f.write(audio_response.content)
-                
-                # Load audio and trim to 15 seconds
-                audio_clip = AudioFileClip(audio_path).subclip(0, clip_duration)
-                
-                # Add fade in/out for smooth transitions
-                audio_clip = audio_clip.audio_fadein(1.0).audio_fadeout(1.0)
-            except Exception as e:
-                print(f"Error loading audio: {e}. Creating silent video instead.")
-                has_audio = False
-                audio_clip = None
-        else:
-            print(f"No preview URL for '{song_data['song_name']}'. Creating silent video.")
-            audio_clip = None
-        
-        # Create gradient with highlight effect
-        base_color = hex_to_rgb(song_data['artwork_bg_color'])
-        gradient_img = create_highlight_gradient((width, height), base_color)
-        
-        # Add subtle vignette effect to background
-        vignette_mask = create_vignette((width, height), 0.2)
-        vignette_mask = vignette_mask.filter(ImageFilter.GaussianBlur(radius=150))
-        gradient_img = Image.composite(
-            gradient_img, 
-            Image.new('RGB', (width, height), (0, 0, 0)), 
-            vignette_mask
-        )
+        x1, y1 = max(0, layer['x']), max(0, layer['y'])
+        x2 = min(width, layer['x'] + layer['width'])
+        y2 = min(height, layer['y'] + layer['height'])
+        if x1 >= x2 or y1 >= y2:
+            continue
         
-        # Save and create clip from background
-        bg_path = os.path.join(temp_dir, 'bg.png')
-        gradient_img.save(bg_path)
-        background = ImageClip(bg_path).set_duration(clip_duration)
-        
-        # Download artwork
-        artwork_url = song_data['artwork_url']
-        artwork_response = requests.get(artwork_url)
-        artwork_path = os.path.join(temp_dir, 'artwork.jpg')
-        with open(artwork_path, 'wb') as f:
-            f.write(artwork_response.content)
-        
-        # Load artwork with Pillow and enhance
-        with Image.open(artwork_path) as img:
-            # Resize artwork
-            img = img.resize((800, 800), Image.Resampling.LANCZOS)
-            
-            # Create mask for rounded corners
-            mask = Image.new('L', img.size, 0)
-            radius = 25  # Corner radius
-            
-            # Draw the rounded rectangle on the mask
-            draw = ImageDraw.Draw(mask)
-            draw.rounded_rectangle([(0, 0), (799, 799)], radius=radius, fill=255)
-            
-            # Create a new RGBA image
-            artwork_rounded = Image.new('RGBA', img.size, (0, 0, 0, 0))
-            artwork_rounded.paste(img, (0, 0), mask)
-            
-            # Create a subtle drop shadow
-            shadow = Image.new('RGBA', (img.width + 60, img.height + 60), (0, 0, 0, 0))
-            shadow_draw = ImageDraw.Draw(shadow)
-            
-            # Draw bottom shadow with reduced opacity
-            shadow_draw.rounded_rectangle([
-                (30, 30 + img.height - 20),
-                (img.width + 30, img.height + 40)
-            ], radius=radius, fill=(0, 0, 0, 40))
-            
-            # Add blur for softer shadow
-            shadow = shadow.filter(ImageFilter.GaussianBlur(radius=30))
-            
-            # Save shadow and artwork
-            shadow_path = os.path.join(temp_dir, 'shadow.png')
-            artwork_path = os.path.join(temp_dir, 'artwork.png')
-            shadow.save(shadow_path)
-            artwork_rounded.save(artwork_path)
-        
-        # Set font paths - for GitHub Actions, use fonts in the repository
-        font_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
-        outfit_bold = f"{font_dir}/Outfit-Bold.ttf"
-        outfit_semibold = f"{font_dir}/Outfit-SemiBold.ttf"
-        outfit_medium = f"{font_dir}/Outfit-Medium.ttf"
-        outfit_regular = f"{font_dir}/Outfit-Regular.ttf"
-        
-        # Calculate positions starting with artwork
-        artwork_x = (width - 800) / 2
-        artwork_y = height * 0.25  # Position artwork at 25% from top
-        
-        # Create "WEEKLY ROTATION" text (left-aligned) - made bolder with semibold font
-        weekly_rotation_text = TextClip(
-            txt="NEW MUSIC TODAY",
-            fontsize=42,
-            color='white',
-            font=outfit_semibold,  # Changed to semibold for more emphasis
-            method='label',
-            stroke_color='rgba(0,0,0,0.3)',
-            stroke_width=1
-        ).set_duration(clip_duration)
+        # What the dynamic layer is drawn over, plus any static layer that
+        # is drawn on top of it later and has to be put back every frame
+        under = base[y1:y2, x1:x2].copy()
+        over = [
+            later for later in layers[i + 1:]
+            if later['draw'] is None
+            and later['x'] < x2 and later['x'] + later['width'] > x1
+            and later['y'] < y2 and later['y'] + later['height'] > y1
+        ]
+        dynamic.append((layer, (x1, y1, x2, y2), under, over))
+    
+    base.flags.writeable = False
+    
+    def render_frame(t, out=None):
+        if out is None:
+            out = np.empty_like(base)
+        np.copyto(out, base)
+        
+        for layer, (x1, y1, x2, y2), under, over in dynamic:
+            region = out[y1:y2, x1:x2]
+            region[...] = under
+            layer['draw'](region, t)
+            for later in over:
+                blit_layer(region, later['image'], later['alpha'], later['x'] - x1, later['y'] - y1)
+        
+        return out
+    
+    return render_frame
+
+
+def load_artwork(artwork_bytes, size=ARTWORK_SIZE):
+    """Decode artwork and downscale it to size x size.
+    
+    Large JPEGs are decoded at a reduced DCT scale (never below the target)
+    and anything still over twice the target is shrunk with Image.reduce
+    before the final LANCZOS resize, so a 3000px cover never gets fully
+    decoded. Returns the image and the decode stats.
+    """
+    started = time.perf_counter()
+    img = Image.open(io.BytesIO(artwork_bytes))
+    source_size = img.size
+    
+    # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale
+    img.draft('RGB', (size, size))
+    img.load()
+    decoded_size = img.size
+    peak_bytes = decoded_size[0] * decoded_size[1] * len(img.getbands())
+    
+    # Cheap box reduction, keeping enough pixels for a sharp final resize
+    factor = min(img.size) // (size * 2)
+    if factor > 1:
+        img = img.reduce(factor)
+    
+    img = img.resize((size, size), Image.Resampling.LANCZOS)
+    stats = {
+        'source_size': source_size,
+        'decoded_size': decoded_size,
+        'decode_seconds': time.perf_counter() - started,
+        'peak_mb': peak_bytes / (1024 * 1024),
+    }
+    return img, stats
+
+def get_video_filename(song_data, index, date):
+    """Build the video file name, matching apple_music.generate_video_url"""
+    # Sanitize song name and artist for filename
+    safe_song_name = song_data['song_name'].replace(" ", "_").replace("/", "_").replace("\\", "_")
+    safe_artist = song_data['artist'].replace(" ", "_").replace("/", "_").replace("\\", "_")
+    
+    # Add numbered prefix (01, 02, etc.)
+    return f"{index+1:02d}_{safe_song_name}_{safe_artist}_{date}.mp4"
+
+def compute_render_fingerprint(song_data, has_audio, artwork_bytes, audio_bytes, size, encoder_profile):
+    """Hash everything that affects the rendered video"""
+    inputs = {
+        # Song fields that end up in the video
+        'song_name': song_data['song_name'],
+        'artist': song_data['artist'],
+        'artwork_bg_color': song_data['artwork_bg_color'],
+        'selected_date': song_data.get('selected_date'),
+        'has_audio': has_audio,
+        # Downloaded content
+        'artwork_sha256': hashlib.sha256(artwork_bytes).hexdigest(),
+        'audio_sha256': hashlib.sha256(audio_bytes).hexdigest() if audio_bytes else None,
+        # Template and output settings
+        'template_version': TEMPLATE_VERSION,
+        'background_version': BACKGROUND_VERSION,
+        'size': list(size),
+        'fps': VIDEO_FPS,
+        'duration': CLIP_DURATION,
+        'encoder_profile': encoder_profile or DEFAULT_ENCODER_PROFILE,
+    }
+    encoded = json.dumps(inputs, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def compute_song_key(song_data, formats, encoder_profile=None):
+    """Hash a song's listed inputs and the render settings, without downloading anything"""
+    inputs = {
+        'song_name': song_data['song_name'],
+        'artist': song_data['artist'],
+        'artwork_bg_color': song_data['artwork_bg_color'],
+        'selected_date': song_data.get('selected_date'),
+        'artwork_url': song_data.get('artwork_url'),
+        'preview_url': song_data.get('preview_url', '').strip(),
+        'template_version': TEMPLATE_VERSION,
+        'background_version': BACKGROUND_VERSION,
+        'formats': {name: get_video_format(name) for name in formats},
+        'fps': VIDEO_FPS,
+        'duration': CLIP_DURATION,
+        'encoder_profile': encoder_profile or DEFAULT_ENCODER_PROFILE,
+    }
+    encoded = json.dumps(inputs, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def download_song_assets(song_data):
+    """Download (or read from the prefetch cache) a song's preview and artwork"""
+    # Check if preview_url exists and is not empty
+    audio_url = song_data.get('preview_url', '').strip()
+    assets = {'has_audio': bool(audio_url), 'audio_path': None, 'audio_bytes': None}
+    
+    if assets['has_audio']:
+        try:
+            assets['audio_path'] = download_asset(audio_url)
+            with open(assets['audio_path'], 'rb') as f:
+                assets['audio_bytes'] = f.read()
+        except Exception as e:
+            print(f"Error loading audio: {e}. Creating silent video instead.")
+            assets['has_audio'] = False
+    else:
+        print(f"No preview URL for '{song_data['song_name']}'. Creating silent video.")
+    
+    assets['artwork_bytes'] = fetch_asset_bytes(song_data['artwork_url'])
+    return assets
+
+def decode_song_audio(audio_path, clip_duration):
+    """Decode the clip's length of a preview once, faded in and out, or None if it can't be read"""
+    try:
+        audio_samples = decode_audio(audio_path, duration=clip_duration)
+        
+        # Add fade in/out for smooth transitions
+        return apply_audio_fades(audio_samples, fade_in=1.0, fade_out=1.0)
+    except Exception as e:
+        print(f"Error loading audio: {e}. Creating silent video instead.")
+        return None
+
+def print_artwork_stats(artwork_stats):
+    """Print how an artwork was decoded"""
+    print(f"Artwork: {artwork_stats['source_size'][0]}x{artwork_stats['source_size'][1]} decoded at "
+          f"{artwork_stats['decoded_size'][0]}x{artwork_stats['decoded_size'][1]} in "
+          f"{artwork_stats['decode_seconds'] * 1000:.0f}ms, peak {artwork_stats['peak_mb']:.1f}MB")
+
+def create_song_renderer(song_data, size, scale, background, artwork, base_color, has_audio, clip_duration, stages=None):
+    """Lay out one song's layers for a frame size and return render_frame(t, out=None).
+    
+    Every size and position is a full-size measure scaled by scale, and the
+    layout is centered horizontally in size. The artwork, text and compose
+    stages are timed into stages (see timed_stage).
+    """
+    width, height = size
+    artwork_size = scale_px(ARTWORK_SIZE, scale)
+    
+    # Create a new RGBA image with rounded corners
+    with timed_stage(stages, 'artwork'):
+        if artwork.size != (artwork_size, artwork_size):
+            artwork = artwork.resize((artwork_size, artwork_size), Image.Resampling.LANCZOS)
+        mask = get_template_asset('artwork_mask', build_artwork_mask, scale)
+        artwork_rounded = Image.new('RGBA', artwork.size, (0, 0, 0, 0))
+        artwork_rounded.paste(artwork, (0, 0), mask)
+    
+    # Calculate positions starting with artwork
+    artwork_x = (width - artwork_size) / 2
+    artwork_y = height * 0.25  # Position artwork at 25% from top
+    
+    # Maximum width for text
+    max_text_width = scale_px(780, scale)
+    
+    # Rasterize every text layer
+    with timed_stage(stages, 'text'):
+        # Create "WEEKLY ROTATION" text (left-aligned)
+        weekly_rotation_text = create_image_layer(get_template_asset('header_text', build_header_text, scale))
         
         # Create date text (right-aligned) - made lighter
         date_str = song_data.get('selected_date', datetime.datetime.now().strftime("%Y-%m-%d"))
@@ -301,179 +947,410 @@ def generate_music_preview_video(song_data, index=0):
         except:
             formatted_date = date_str
             
-        date_title = TextClip(
-            txt=formatted_date,
-            fontsize=42,
-            color='rgba(255,255,255,0.7)',  # Made more transparent for lighter appearance
-            font=outfit_regular,
-            method='label'
-        ).set_duration(clip_duration)
-        
-        # Position for text - right above artwork with small margin
-        text_margin = 20
-        header_y = artwork_y - weekly_rotation_text.size[1] - text_margin
-        artwork_right = artwork_x + 800
-        
-        # Position shadow
-        shadow_y = artwork_y - 20
-        shadow_x = (width - 840) / 2
-        
-        # Load shadow and artwork clips
-        shadow_clip = ImageClip(shadow_path).set_position((shadow_x, shadow_y))
-        artwork_clip = ImageClip(artwork_path).set_position((artwork_x, artwork_y))
-        
-        # Maximum width for text
-        max_text_width = 780
+        date_title = create_image_layer(render_text(
+            formatted_date,
+            font=OUTFIT_REGULAR,
+            fontsize=scale_px(42, scale),
+            color='rgba(255,255,255,0.7)'  # Made more transparent for lighter appearance
+        ))
         
         # Song title with scrolling if needed
-        song_title_clip = create_scrolling_text_clip(
+        song_title_layer = create_scrolling_text_layer(
             text=song_data['song_name'],
-            fontsize=80,
+            fontsize=scale_px(80, scale),
             color='white',
-            font=outfit_bold,
+            font=OUTFIT_BOLD,
             duration=clip_duration,
             max_width=max_text_width,
             stroke_color='rgba(0,0,0,0.3)',
-            stroke_width=1
+            stroke_width=scale_px(1, scale),
+            scroll_gap=scale_px(100, scale)
         )
         
         # Artist name with scrolling if needed
-        artist_name_clip = create_scrolling_text_clip(
+        artist_name_layer = create_scrolling_text_layer(
             text=song_data['artist'],
-            fontsize=48,
+            fontsize=scale_px(48, scale),
             color='rgba(255,255,255,0.85)',
-            font=outfit_regular,
+            font=OUTFIT_REGULAR,
             duration=clip_duration,
-            max_width=max_text_width
+            max_width=max_text_width,
+            scroll_gap=scale_px(100, scale)
         )
         
         # Preview text - adjust based on whether we have audio
         preview_text_str = "SONG PREVIEW" if has_audio else "NO PREVIEW AVAILABLE"
-        preview_text = TextClip(
-            txt=preview_text_str,
-            fontsize=24,
-            color='rgba(255,255,255,0.6)',
-            font=outfit_regular,
-            method='label'
-        ).set_duration(clip_duration)
-        
-        # Positioning
-        artwork_bottom = artwork_y + 800
-        spacing_after_artwork = 100
-        spacing_between_text = 12
-        
-        # Center the clips horizontally
-        song_title_pos = ((width - max_text_width) / 2, artwork_bottom + spacing_after_artwork)
-        artist_name_pos = ((width - max_text_width) / 2, song_title_pos[1] + song_title_clip.size[1] + spacing_between_text)
-        
-        # Position the text clips
-        song_title_clip = song_title_clip.set_position(('center', song_title_pos[1]))
-        artist_name_clip = artist_name_clip.set_position(('center', artist_name_pos[1]))
-        
-        # Progress bar dimensions
-        progress_bar_width = 800
-        progress_bar_height = 6
-        progress_bar_y = artist_name_pos[1] + artist_name_clip.size[1] + 60
-        
-        # Create progress bar background
-        progress_bg = ColorClip(
-            size=(progress_bar_width, progress_bar_height),
-            color=(50, 50, 50)
-        ).set_duration(clip_duration)
-        
-        progress_bg_pos = ((width - progress_bar_width) / 2, progress_bar_y)
-        
-        # Create animated progress bar
-        def make_progress_bar_frame(t):
-            progress_width = int(progress_bar_width * (t / clip_duration))
-            progress_img = np.zeros((progress_bar_height, progress_bar_width, 3), dtype=np.uint8)
-            
-            # Create gradient colors for progress bar
-            r, g, b = base_color
-            h, s, v = colorsys.rgb_to_hsv(r/255.0, g/255.0, b/255.0)
-            
-            # Ensure high brightness for better contrast
-            bright_h = h
-            bright_s = max(0.4, min(0.9, s))
-            bright_v = max(0.85, min(1.0, v * 1.5))
-            
-            # Convert to RGB
-            bright_r, bright_g, bright_b = colorsys.hsv_to_rgb(bright_h, bright_s, bright_v)
-            bright_color = (int(min(255, bright_r*255)), int(min(255, bright_g*255)), int(min(255, bright_b*255)))
-            
-            # Fill progress portion
-            progress_img[:, :progress_width, 0] = bright_color[0]
-            progress_img[:, :progress_width, 1] = bright_color[1]
-            progress_img[:, :progress_width, 2] = bright_color[2]
-            
-            return progress_img
-        
-        progress_bar = VideoClip(make_frame=make_progress_bar_frame, duration=clip_duration)
-        progress_bar = progress_bar.set_position(progress_bg_pos)
-        
-        # Position preview text under progress bar
-        preview_text_pos = ((width - preview_text.size[0]) / 2, progress_bar_y + progress_bar_height + 12)
-        
-        # Compose final video
-        final_clip = CompositeVideoClip([
-            background,
-            weekly_rotation_text.set_position((artwork_x, header_y)),
-            date_title.set_position((artwork_right - date_title.size[0], header_y)),
-            shadow_clip,
-            artwork_clip,
-            song_title_clip,
-            artist_name_clip,
-            progress_bg.set_position(progress_bg_pos),
-            progress_bar,
-            preview_text.set_position(preview_text_pos)
-        ]).set_duration(clip_duration)
-        
-        # Set audio to the final clip only if we have audio
-        if audio_clip is not None:
-            final_clip = final_clip.set_audio(audio_clip)
-        
-        # Create output directory if it doesn't exist
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
-        output_dir = os.path.join("video_output", today)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Sanitize song name and artist for filename
-        safe_song_name = song_data['song_name'].replace(" ", "_").replace("/", "_").replace("\\", "_")
-        safe_artist = song_data['artist'].replace(" ", "_").replace("/", "_").replace("\\", "_")
-        
-        # Add numbered prefix (01, 02, etc.)
-        filename = f"{index+1:02d}_{safe_song_name}_{safe_artist}_{today}.mp4"
-        
-        # Write video file with or without audio
-        output_path = os.path.join(output_dir, filename)
-        if audio_clip is not None:
-            final_clip.write_videofile(
-                output_path,
-                fps=24,
-                codec='libx264',
-                audio_codec='aac'
-            )
-        else:
-            # Write video without audio
-            final_clip.write_videofile(
-                output_path,
-                fps=24,
-                codec='libx264',
-                audio=False
-            )
-        
-        print(f"Video saved to: {output_path}")
-        
-        # Upload to GCS
-        bucket_name = os.environ.get('GCS_BUCKET_NAME')
-        gcs_path = f"videos/{today}/individual/{filename}"
-        upload_video_to_gcs(output_path, bucket_name, gcs_path)
-        
-        return output_path
-        
+        preview_text = create_image_layer(render_text(
+            preview_text_str,
+            font=OUTFIT_REGULAR,
+            fontsize=scale_px(24, scale),
+            color='rgba(255,255,255,0.6)'
+        ))
+    
+    # Position for text - right above artwork with small margin
+    text_margin = scale_px(20, scale)
+    header_y = artwork_y - weekly_rotation_text['height'] - text_margin
+    artwork_right = artwork_x + artwork_size
+    
+    # Position shadow
+    shadow_y = artwork_y - scale_px(20, scale)
+    shadow_x = (width - scale_px(840, scale)) / 2
+    
+    # Shadow and artwork layers
+    shadow_layer = create_image_layer(get_template_asset('shadow', build_artwork_shadow, scale))
+    set_layer_position(shadow_layer, shadow_x, shadow_y)
+    artwork_layer = create_image_layer(np.array(artwork_rounded))
+    set_layer_position(artwork_layer, artwork_x, artwork_y)
+    
+    # Positioning
+    artwork_bottom = artwork_y + artwork_size
+    spacing_after_artwork = scale_px(100, scale)
+    spacing_between_text = scale_px(12, scale)
+    
+    # Center the layers horizontally
+    song_title_pos = ((width - max_text_width) / 2, artwork_bottom + spacing_after_artwork)
+    artist_name_pos = ((width - max_text_width) / 2, song_title_pos[1] + song_title_layer['height'] + spacing_between_text)
+    
+    # Position the text layers
+    set_layer_position(song_title_layer, (width - song_title_layer['width']) / 2, song_title_pos[1])
+    set_layer_position(artist_name_layer, (width - artist_name_layer['width']) / 2, artist_name_pos[1])
+    
+    # Progress bar dimensions
+    progress_bar_width = scale_px(PROGRESS_BAR_WIDTH, scale)
+    progress_bar_height = scale_px(PROGRESS_BAR_HEIGHT, scale)
+    progress_bar_y = artist_name_pos[1] + artist_name_layer['height'] + scale_px(60, scale)
+    
+    # Create progress bar background
+    progress_bg = create_image_layer(get_template_asset('progress_bg', build_progress_bg, scale))
+    
+    progress_bg_pos = ((width - progress_bar_width) / 2, progress_bar_y)
+    
+    # Create animated progress bar, the color is worked out once per song
+    progress_bar = create_progress_bar_layer(
+        progress_bar_width,
+        progress_bar_height,
+        get_progress_color(base_color),
+        clip_duration
+    )
+    
+    # Position preview text under progress bar
+    preview_text_pos = ((width - preview_text['width']) / 2, progress_bar_y + progress_bar_height + scale_px(12, scale))
+    
+    # Compose final video: static layers are flattened once and only
+    # the progress bar and scrolling text are redrawn per frame
+    with timed_stage(stages, 'compose'):
+        render_frame = create_frame_renderer((width, height), [
+            create_image_layer(background),
+            set_layer_position(weekly_rotation_text, artwork_x, header_y),
+            set_layer_position(date_title, artwork_right - date_title['width'], header_y),
+            shadow_layer,
+            artwork_layer,
+            song_title_layer,
+            artist_name_layer,
+            set_layer_position(progress_bg, *progress_bg_pos),
+            set_layer_position(progress_bar, *progress_bg_pos),
+            set_layer_position(preview_text, *preview_text_pos)
+        ])
+    return timed_frames(render_frame, stages)
+
+def get_cpu_seconds(thread_only=False):
+    """CPU time of this process and its finished children (ffmpeg), or of the calling thread"""
+    if thread_only:
+        return time.thread_time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def get_current_rss_mb(children=True):
+    """RSS of this process right now, plus its running children (ffmpeg) if
+    children, in MB. None where /proc isn't available."""
+    try:
+        pids = [str(os.getpid())]
+        if children:
+            for thread_id in os.listdir('/proc/self/task'):
+                with open(f'/proc/self/task/{thread_id}/children') as f:
+                    pids += f.read().split()
+        pages = 0
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    pages += int(f.read().split()[1])
+            except (OSError, ValueError, IndexError):
+                # The child exited in the meantime
+                pass
+    except OSError:
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+def sample_rss():
+    """Update every open RSS window with a new reading, forever (runs on its own thread)"""
+    while True:
+        time.sleep(RSS_SAMPLE_SECONDS)
+        with _rss_lock:
+            windows = list(_rss_sampler['windows'].values())
+        if not windows:
+            continue
+        readings = {}
+        for window in windows:
+            if window['children'] not in readings:
+                readings[window['children']] = get_current_rss_mb(window['children'])
+            window['peak_mb'] = max(window['peak_mb'], readings[window['children']] or 0.0)
+
+def open_rss_window(children=True):
+    """Start tracking the peak RSS of a block, see close_rss_window.
+    
+    A background thread samples RSS_SAMPLE_SECONDS apart while any window
+    is open, so the peak of one block isn't the process lifetime's.
+    """
+    window = {'children': children, 'peak_mb': get_current_rss_mb(children) or 0.0}
+    with _rss_lock:
+        # Started once per process, a forked child needs its own
+        if _rss_sampler['pid'] != os.getpid():
+            _rss_sampler['pid'] = os.getpid()
+            _rss_sampler['windows'] = {}
+            threading.Thread(target=sample_rss, name='rss-sampler', daemon=True).start()
+        _rss_sampler['windows'][id(window)] = window
+    return window
+
+def close_rss_window(window):
+    """Stop tracking a window and return its peak RSS in MB.
+    
+    Falls back to the process high-water mark without /proc.
+    """
+    with _rss_lock:
+        del _rss_sampler['windows'][id(window)]
+    current = get_current_rss_mb(window['children'])
+    if current is None:
+        return get_peak_rss_mb()
+    return max(window['peak_mb'], current)
+
+def add_stage(stages, name, wall_seconds=0.0, cpu_seconds=0.0, bytes_transferred=0, peak_rss_mb=0.0):
+    """Add a measurement to stages[name]: times and bytes add up, peak RSS is the max"""
+    with _stage_lock:
+        stage = stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'bytes': 0, 'peak_rss_mb': 0.0})
+        stage['wall_seconds'] += wall_seconds
+        stage['cpu_seconds'] += cpu_seconds
+        stage['bytes'] += bytes_transferred
+        stage['peak_rss_mb'] = max(stage['peak_rss_mb'], peak_rss_mb)
+    return stage
+
+@contextlib.contextmanager
+def timed_stage(stages, name, thread_only=False):
+    """Time a block as stage name of a song, doing nothing if stages is None.
+    
+    Yields a dict whose 'bytes' the block can set. CPU time is the whole
+    process unless thread_only, for blocks that share the process with
+    other work. Peak RSS is sampled while the block runs, this process plus
+    its running ffmpeg children, or this process alone if thread_only.
+    """
+    measured = {'bytes': 0}
+    if stages is None:
+        yield measured
+        return
+    wall = time.perf_counter()
+    cpu = get_cpu_seconds(thread_only)
+    rss_window = open_rss_window(children=not thread_only)
+    try:
+        yield measured
     finally:
-        # Clean up the temporary directory
-        shutil.rmtree(temp_dir)
+        add_stage(
+            stages, name,
+            wall_seconds=time.perf_counter() - wall,
+            cpu_seconds=get_cpu_seconds(thread_only) - cpu,
+            bytes_transferred=measured['bytes'],
+            peak_rss_mb=close_rss_window(rss_window)
+        )
+
+def timed_frames(render_frame, stages):
+    """Wrap render_frame so drawing each frame adds to the compose stage"""
+    if stages is None:
+        return render_frame
+    
+    def render(t, out=None):
+        # Frames are drawn on the pipeline thread while ffmpeg encodes
+        with timed_stage(stages, 'compose', thread_only=True):
+            return render_frame(t, out)
+    return render
+
+def encode_song_video(render_frame, output_path, size, fps, num_frames, encoder_profile, audio_samples, pipeline, num_buffers=None):
+    """Encode one rendered format of a song"""
+    width, height = size
+    if pipeline:
+        # Render into a ring of reusable buffers while ffmpeg encodes
+        pipeline_stats = encode_rendered_frames(
+            render_frame,
+            num_frames,
+            output_path,
+            (width, height),
+            fps=fps,
+            profile=encoder_profile,
+            audio_samples=audio_samples,
+            num_buffers=num_buffers
+        )
+        print(f"Pipeline: {pipeline_stats['frames']} frames, "
+              f"render stalls {pipeline_stats['consumer_stalls']}, encode stalls {pipeline_stats['producer_stalls']}, "
+              f"mean queue depth {pipeline_stats['mean_queue_depth']:.1f}/{pipeline_stats['buffers']} "
+              f"(bottleneck: {pipeline_stats['bottleneck']})")
+    else:
+        # Stream frames straight into ffmpeg, reusing one output buffer
+        frame_buffer = np.empty((height, width, 3), dtype=np.uint8)
+        frames = (render_frame(i / fps, out=frame_buffer) for i in range(num_frames))
+        encode_frames(
+            frames,
+            output_path,
+            (width, height),
+            fps=fps,
+            profile=encoder_profile,
+            audio_samples=audio_samples
+        )
+    print(f"Video saved to: {output_path}")
+    return output_path
+
+def generate_music_preview_video(song_data, index=0, encoder_profile=None, pipeline=RENDER_PIPELINE, upload=upload_video_to_gcs, draft=None, formats=None, videos=None, streaming=False, stages=None, encode=encode_song_video):
+    """Generate a music preview video for a single song, in every requested format.
+    
+    The downloads, decoded audio and artwork, text rasters and background are
+    shared between formats and the formats are encoded in parallel. Each
+    finished file is handed to upload(local_path, bucket_name, blob_name,
+    metadata=...), which uploads it straight away unless the caller queues it.
+    Each format is encoded by encode, with encode_song_video's arguments.
+    draft={'scale', 'fps', 'duration'} renders the same layout smaller, into
+    video_output/draft/, and skips the upload. If videos is a list, each
+    uploaded format's {'format', 'blob_name', 'fingerprint'} is added to it.
+    streaming=True encodes the formats one at a time with the fewest buffers
+    instead (see RENDER_MEMORY_BUDGET_MB). If stages is a dict, each stage's
+    wall time, CPU time, bytes and peak RSS are added to it (see
+    RENDER_STAGES). Returns the first format's path.
+    """
+    formats = formats or OUTPUT_FORMATS
+    draft_scale = draft['scale'] if draft else 1.0
+    fps = draft['fps'] if draft else VIDEO_FPS
+    clip_duration = draft['duration'] if draft else CLIP_DURATION
+    if draft:
+        encoder_profile = DRAFT_ENCODER_PROFILE
+    
+    # Download audio and artwork before doing any rendering work
+    with timed_stage(stages, 'download') as measured:
+        assets = download_song_assets(song_data)
+        measured['bytes'] = len(assets['artwork_bytes']) + len(assets['audio_bytes'] or b'')
+    has_audio = assets['has_audio']
+    artwork_bytes = assets['artwork_bytes']
+    audio_bytes = assets['audio_bytes']
+    
+    # Where the videos go
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    filename = get_video_filename(song_data, index, today)
+    bucket_name = os.environ.get('GCS_BUCKET_NAME')
+    
+    # Frame size and layout scale of each format
+    jobs = []
+    for name in formats:
+        video_format = get_video_format(name)
+        size = get_video_size(draft_scale, video_format['size'])
+        job = {
+            'name': name,
+            'size': size,
+            # Every size and position in the layout is a full-size measure scaled by this
+            'scale': video_format['scale'] * draft_scale,
+            'gcs_path': get_video_blob_name(today, filename, name),
+        }
+        
+        # Skip the render and upload if the same inputs were already rendered
+        job['fingerprint'] = compute_render_fingerprint(
+            song_data, has_audio, artwork_bytes, audio_bytes, size, encoder_profile
+        )
+        if not draft and RENDER_CACHE and get_uploaded_fingerprint(bucket_name, job['gcs_path']) == job['fingerprint']:
+            print(f"Unchanged since last render, skipping: gs://{bucket_name}/{job['gcs_path']}")
+            job['output_path'] = f"gs://{bucket_name}/{job['gcs_path']}"
+        jobs.append(job)
+        if videos is not None and not draft:
+            videos.append({'format': name, 'blob_name': job['gcs_path'], 'fingerprint': job['fingerprint']})
+    
+    render_jobs = [job for job in jobs if 'output_path' not in job]
+    if not render_jobs:
+        return jobs[0]['output_path']
+    
+    audio_samples = None
+    if has_audio:
+        with timed_stage(stages, 'audio'):
+            audio_samples = decode_song_audio(assets['audio_path'], clip_duration)
+        has_audio = audio_samples is not None
+    
+    # Create gradient with highlight effect and subtle vignette once, at the
+    # tallest size. Shorter formats use a center crop of it.
+    base_color = hex_to_rgb(song_data['artwork_bg_color'])
+    background_width = max(job['size'][0] for job in render_jobs)
+    background_height = max(job['size'][1] for job in render_jobs)
+    with timed_stage(stages, 'background'):
+        background = get_cached_background(
+            (background_width, background_height), base_color, cache_size=1 if streaming else None
+        )
+    
+    # Decode and resize artwork from memory with Pillow, at the largest size
+    # needed. Smaller formats resize from this.
+    artwork_size = max(scale_px(ARTWORK_SIZE, job['scale']) for job in render_jobs)
+    with timed_stage(stages, 'artwork'):
+        artwork, artwork_stats = load_artwork(artwork_bytes, artwork_size)
+    print_artwork_stats(artwork_stats)
+    
+    num_frames = int(round(clip_duration * fps))
+    for job in render_jobs:
+        # Create output directory if it doesn't exist. Story videos stay at
+        # the top level, other formats get their own folder.
+        output_dir = os.path.join("video_output", "draft", today) if draft else os.path.join("video_output", today)
+        if job['name'] != 'story':
+            output_dir = os.path.join(output_dir, get_video_format(job['name'])['folder'])
+        os.makedirs(output_dir, exist_ok=True)
+        job['local_path'] = os.path.join(output_dir, filename)
+    
+    def create_job_renderer(job):
+        width, height = job['size']
+        top = (background_height - height) // 2
+        left = (background_width - width) // 2
+        return create_song_renderer(
+            song_data, job['size'], job['scale'],
+            background[top:top + height, left:left + width],
+            artwork, base_color, has_audio, clip_duration, stages
+        )
+    
+    # The encode stage includes drawing the frames, which the compose stage
+    # also counts on its own
+    if streaming:
+        # One format at a time, each layout is dropped before the next is built
+        for job in render_jobs:
+            render_frame = create_job_renderer(job)
+            with timed_stage(stages, 'encode') as measured:
+                job['output_path'] = encode(
+                    render_frame, job['local_path'], job['size'], fps,
+                    num_frames, encoder_profile, audio_samples, pipeline, num_buffers=STREAMING_BUFFERS
+                )
+                if stages is not None:
+                    measured['bytes'] = os.path.getsize(job['output_path'])
+    else:
+        # One render/encode pipeline per format, all at the same time
+        for job in render_jobs:
+            job['render_frame'] = create_job_renderer(job)
+        with timed_stage(stages, 'encode') as measured:
+            with ThreadPoolExecutor(max_workers=len(render_jobs), thread_name_prefix='format') as executor:
+                futures = [
+                    executor.submit(
+                        encode, job['render_frame'], job['local_path'], job['size'], fps,
+                        num_frames, encoder_profile, audio_samples, pipeline
+                    )
+                    for job in render_jobs
+                ]
+                for job, future in zip(render_jobs, futures):
+                    job['output_path'] = future.result()
+            if stages is not None:
+                measured['bytes'] = sum(os.path.getsize(job['output_path']) for job in render_jobs)
+    
+    # Drafts are only for looking at locally
+    if not draft:
+        for job in render_jobs:
+            # Upload to GCS, remembering what it was rendered from
+            upload(job['output_path'], bucket_name, job['gcs_path'], metadata={FINGERPRINT_METADATA_KEY: job['fingerprint']})
+    
+    return jobs[0]['output_path']
 
 def fetch_songs_from_spreadsheet(spreadsheet_id):
     """Fetch songs data from Google Spreadsheet"""
@@ -527,7 +1404,7 @@ def fetch_songs_from_gcs(bucket_name, blob_name, service_account_path=None):
     if service_account_path:
         storage_client = storage.Client.from_service_account_json(service_account_path)
     else:
-        storage_client = storage.Client()
+        storage_client = get_storage_client()
     
     # Get bucket and blob
     bucket = storage_client.bucket(bucket_name)
@@ -541,33 +1418,741 @@ def fetch_songs_from_gcs(bucket_name, blob_name, service_account_path=None):
     
     return songs_data
 
-def process_latest_songs():
-    """Process songs marked for video creation with today's date"""
+class BatchRenderError(RuntimeError):
+    """Raised after a batch finishes when some of its songs failed to render"""
+    def __init__(self, output_paths, failures):
+        self.output_paths = output_paths
+        self.failures = failures
+        super().__init__(f"{len(failures)} song(s) failed to render: " + ", ".join(
+            f"#{failure['index']+1} '{failure['song_name']}'" for failure in failures
+        ))
+
+def get_available_memory_mb():
+    """Return available system memory in MB, or None if it can't be determined"""
     try:
-        bucket_name = os.environ.get('GCS_BUCKET_NAME')
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def get_peak_rss_mb():
+    """Peak RSS of this process plus its largest finished child (ffmpeg), in MB"""
+    # ru_maxrss is in KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return (own + children) / 1024
+
+def get_render_worker_count(num_songs, memory_budget_mb=None):
+    """Work out how many songs to render in parallel"""
+    if RENDER_WORKERS:
+        return max(1, min(int(RENDER_WORKERS), num_songs))
+    
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    
+    # A song's formats are drawn by threads of its one process, so they
+    # share a core for the drawing and x264 spreads the encodes over the
+    # spare ones: one song per core. Memory is per format though, as each
+    # song holds all of its formats at once unless it streams them one by
+    # one within a memory budget.
+    formats = 1 if memory_budget_mb else max(1, len(OUTPUT_FORMATS))
+    workers = cores
+    available_mb = memory_budget_mb or get_available_memory_mb()
+    if available_mb is not None:
+        workers = min(workers, available_mb // (RENDER_WORKER_MEMORY_MB * formats))
+    
+    return max(1, min(workers, num_songs))
+
+def get_batch_file_name(kind, date, shard_index=1, shard_count=1):
+    """File name of a date's batch file (render_manifest, render_stats), one per shard"""
+    if shard_count > 1:
+        return f"{kind}_{date}_{shard_index}of{shard_count}.json"
+    return f"{kind}_{date}.json"
+
+def get_manifest_blob_name(date, manifest_name):
+    """GCS path of a render manifest, next to the date's videos"""
+    return f"videos/{date}/{manifest_name}"
+
+def load_render_manifest(bucket_name, date, manifest_name):
+    """Load a date's render manifest, the newer of the local and GCS copies"""
+    copies = []
+    path = os.path.join(MANIFEST_DIR, manifest_name)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                copies.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {path}: {e}")
+    
+    blob_name = get_manifest_blob_name(date, manifest_name)
+    try:
+        blob = get_storage_client().bucket(bucket_name).get_blob(blob_name)
+        if blob is not None:
+            copies.append(json.loads(blob.download_as_bytes()))
+    except Exception as e:
+        print(f"Could not load gs://{bucket_name}/{blob_name}: {e}")
+    
+    copies = [manifest for manifest in copies if manifest.get('date') == date]
+    if not copies:
+        return {'name': manifest_name, 'date': date, 'updated': None, 'songs': {}}
+    return max(copies, key=lambda manifest: manifest.get('updated') or 0)
+
+def save_render_manifest(manifest, bucket_name):
+    """Write the manifest locally, then to GCS. A failed GCS write is only reported"""
+    manifest['updated'] = time.time()
+    content = json.dumps(manifest, indent=2, sort_keys=True)
+    
+    write_atomically(os.path.join(MANIFEST_DIR, manifest['name']), lambda f: f.write(content.encode('utf-8')))
+    
+    blob_name = get_manifest_blob_name(manifest['date'], manifest['name'])
+    try:
+        blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+        blob.upload_from_string(content, content_type='application/json')
+    except Exception as e:
+        print(f"Could not save gs://{bucket_name}/{blob_name}: {e}")
+
+def is_song_finished(entry, song_key, bucket_name):
+    """Whether a manifest entry shows the song done from the same inputs, with
+    every video still in GCS carrying the fingerprint it was uploaded with"""
+    if not entry or entry.get('status') != 'done' or entry.get('song_key') != song_key:
+        return False
+    if not entry.get('videos'):
+        return False
+    # Metadata lookups only, nothing is downloaded
+    return all(
+        get_uploaded_fingerprint(bucket_name, video['blob_name']) == video['fingerprint']
+        for video in entry['videos']
+    )
+
+def skip_finished_songs(indexed_songs, manifest, bucket_name, song_keys, resumed):
+    """Yield the (index, song) pairs the manifest doesn't show as finished.
+    
+    Each song's key goes in song_keys for recording it later. Finished songs
+    get a result record in resumed instead of being yielded.
+    """
+    for i, song in indexed_songs:
+        song_keys[i] = compute_song_key(song, OUTPUT_FORMATS)
+        entry = manifest['songs'].get(str(i))
+        if RENDER_CACHE and is_song_finished(entry, song_keys[i], bucket_name):
+            print(f"Already rendered, skipping video {i+1} '{song['song_name']}'")
+            resumed.append({
+                'index': i,
+                'song_name': song.get('song_name', ''),
+                'output_path': f"gs://{bucket_name}/{entry['videos'][0]['blob_name']}",
+                'uploads': [],
+                'timings': entry.get('timings', {}),
+                'stages': entry.get('stages', {}),
+                'peak_rss_mb': entry.get('peak_rss_mb'),
+                'error': None,
+                'pid': os.getpid(),
+                'resumed': True,
+            })
+            continue
+        yield i, song
+
+def record_render_result(manifest, result, song_key):
+    """Record a finished (or failed) song in the manifest"""
+    manifest['songs'][str(result['index'])] = {
+        'song_name': result['song_name'],
+        'song_key': song_key,
+        'status': 'done' if result['error'] is None else 'failed',
+        'error': result['error'],
+        'output_path': result['output_path'],
+        'videos': result.get('videos', []),
+        'timings': result.get('timings', {}),
+        # Kept for the render stats of a rerun that skips the song
+        'stages': get_render_record(result)['stages'],
+        'peak_rss_mb': result.get('peak_rss_mb'),
+        'finished_at': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+
+def get_manifest_recorder(manifest, bucket_name, song_keys):
+    """Return on_result(result) for render_songs, saving the manifest after every song"""
+    lock = threading.Lock()
+    
+    def record(result):
+        # Called from upload threads as songs finish
+        with lock:
+            record_render_result(manifest, result, song_keys.get(result['index']))
+            save_render_manifest(manifest, bucket_name)
+    return record
+
+def render_song(song, index, draft=None, streaming=False):
+    """Render one song, returning a result record instead of raising.
+    
+    The uploads aren't done here: their arguments go in result['uploads'] for
+    the parent process to queue on the upload pool.
+    """
+    result = {
+        'index': index,
+        'song_name': song.get('song_name', ''),
+        'output_path': None,
+        'uploads': [],
+        'videos': [],
+        'timings': {},
+        'stages': {},
+        'error': None,
+        'pid': os.getpid(),
+    }
+    
+    def defer_upload(*args, **kwargs):
+        result['uploads'].append((args, kwargs))
+    
+    started = time.time()
+    try:
+        result['output_path'] = generate_music_preview_video(
+            song, index=index, upload=defer_upload, draft=draft, videos=result['videos'], streaming=streaming,
+            stages=result['stages']
+        )
+    except Exception as e:
+        print(f"Error generating video {index+1} for '{result['song_name']}': {e}")
+        traceback.print_exc()
+        result['error'] = str(e)
+    result['timings']['render_seconds'] = round(time.time() - started, 2)
+    result['peak_rss_mb'] = round(get_peak_rss_mb(), 1)
+    result['background_cache'] = get_background_cache_stats()
+    return result
+
+def upload_rendered_video(upload):
+    """Run one of a render result's deferred uploads, returning its upload stage"""
+    args, kwargs = upload
+    stages = {}
+    # Uploads share this process with the other uploads and maybe a render
+    with timed_stage(stages, 'upload', thread_only=True) as measured:
+        upload_video_to_gcs(*args, **kwargs)
+        measured['bytes'] = os.path.getsize(args[0])
+    return stages['upload']
+
+def wait_for_uploads(uploads):
+    """Wait for queued uploads, marking a result failed if its upload failed"""
+    for result, future in uploads:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Error uploading video {result['index']+1} for '{result['song_name']}': {e}")
+            result['error'] = f"Upload failed: {e}"
+
+def render_songs(indexed_songs, workers=1, upload_workers=UPLOAD_WORKERS, draft=None, on_result=None, memory_budget_mb=None):
+    """Render (index, song) pairs one by one or on a process pool, keeping each song's index.
+    
+    indexed_songs can also be a generator that yields songs while they are
+    still being selected (see follow_selection). Each finished video is
+    uploaded on a thread pool in this process while the next songs keep
+    rendering. on_result(result) is called once a song is fully done, its
+    uploads included, possibly from an upload thread. memory_budget_mb
+    streams each song and only runs as many at once as fit in the budget.
+    """
+    results = []
+    uploads = []
+    total = len(indexed_songs) if isinstance(indexed_songs, (list, tuple)) else None
+    streaming = bool(memory_budget_mb)
+    # Largest peak RSS of a song so far, the configured guess until one finishes
+    song_memory = {'peak_mb': RENDER_WORKER_MEMORY_MB}
+    uploader = ThreadPoolExecutor(max_workers=max(1, upload_workers), thread_name_prefix='upload')
+    
+    def completed(result):
+        print(f"Render stats: {json.dumps(get_render_record(result), sort_keys=True)}")
+        if on_result is not None:
+            on_result(result)
+    
+    def finished(result):
+        results.append(result)
+        pending = result.get('uploads', []) if result['error'] is None else []
+        futures = [uploader.submit(upload_rendered_video, upload) for upload in pending]
+        uploads.extend((result, future) for future in futures)
+        if not futures:
+            completed(result)
+            return
+        
+        # Report the song when the last of its uploads is done
+        rendered_at = time.time()
+        remaining = {'count': len(futures)}
+        lock = threading.Lock()
         
-        # Fetch songs data from GCS
-        print(f"Fetching songs data from GCS bucket: {bucket_name}")
-        songs_data = fetch_songs_from_gcs(bucket_name, 'selected_songs.json')
+        def uploaded(_):
+            with lock:
+                remaining['count'] -= 1
+                if remaining['count']:
+                    return
+            for future in futures:
+                if future.exception() is not None:
+                    result['error'] = f"Upload failed: {future.exception()}"
+                    continue
+                stage = future.result()
+                add_stage(
+                    result.setdefault('stages', {}), 'upload',
+                    stage['wall_seconds'], stage['cpu_seconds'], stage['bytes'], stage['peak_rss_mb']
+                )
+            result.setdefault('timings', {})['upload_seconds'] = round(time.time() - rendered_at, 2)
+            completed(result)
+        
+        for future in futures:
+            future.add_done_callback(uploaded)
+    
+    try:
+        if workers <= 1:
+            for position, (i, song) in enumerate(indexed_songs):
+                progress = f"{position+1}/{total}" if total is not None else f"{position+1}"
+                print(f"Generating video {i+1} ({progress}) for '{song['song_name']}' by {song['artist']}")
+                finished(render_song(song, i, draft, streaming))
+        else:
+            print(f"Rendering {total if total is not None else 'selected'} songs on {workers} worker processes")
+            if streaming:
+                print(f"Streaming render within {memory_budget_mb}MB")
+            
+            def max_in_flight():
+                if not streaming:
+                    return workers
+                return max(1, min(workers, int(memory_budget_mb // song_memory['peak_mb'])))
+            
+            # Workers are started fresh rather than forked: the selection
+            # thread (see follow_selection) and the upload threads may be
+            # running, and a fork would copy the locks they hold
+            def start_pool():
+                return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            
+            executor = start_pool()
+            try:
+                futures = {}
+                pending_songs = iter(indexed_songs)
+                while True:
+                    # Each song is submitted as soon as it's available and fits
+                    while len(futures) < max_in_flight():
+                        next_song = next(pending_songs, None)
+                        if next_song is None:
+                            break
+                        i, song = next_song
+                        try:
+                            future = executor.submit(render_song, song, i, draft, streaming)
+                        except BrokenProcessPool:
+                            # A worker died and took the pool down, the songs
+                            # it was running fail below and the rest go on a
+                            # new pool
+                            print("A render worker died, starting new workers")
+                            executor.shutdown(wait=False)
+                            executor = start_pool()
+                            future = executor.submit(render_song, song, i, draft, streaming)
+                        futures[future] = (i, song)
+                    if not futures:
+                        break
+                    
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        i, song = futures.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            # The worker itself died (e.g. out of memory)
+                            result = {'index': i, 'song_name': song.get('song_name', ''), 'output_path': None, 'error': str(e)}
+                        song_memory['peak_mb'] = max(song_memory['peak_mb'], result.get('peak_rss_mb', 0))
+                        status = 'done' if result['error'] is None else 'failed'
+                        print(f"Video {i+1} '{result['song_name']}' {status}")
+                        finished(result)
+            finally:
+                executor.shutdown()
+    finally:
+        # Rendering is done (or the song list failed), let the queued uploads finish
+        wait_for_uploads(uploads)
+        uploader.shutdown()
+    
+    # Keep the index order that the file names and video_url use
+    results.sort(key=lambda result: result['index'])
+    return results
+
+def render_combined_day(indexed_songs, encoder_profile=None, upload_workers=UPLOAD_WORKERS):
+    """Render the day's songs in one encoder session and cut the individual
+    videos and the stitched reels out of it.
+    
+    Keyframes are forced at every song boundary and ffmpeg's segment muxer
+    splits the stream there, so each individual video is a complete file and
+    the reels are stream copies of them. Every frame is encoded once.
+    The reels are previews of the whole selection and are only saved
+    locally: the posted reels are stitched by video_stitcher.py from the
+    curated songs (create_video TRUE) once they are picked.
+    Returns result records like render_songs.
+    """
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    bucket_name = os.environ.get('GCS_BUCKET_NAME')
+    size = get_video_size()
+    scale = get_video_format('story')['scale']
+    frames_per_song = int(round(CLIP_DURATION * VIDEO_FPS))
+    samples_per_song = int(round(CLIP_DURATION * AUDIO_SAMPLE_RATE))
+    
+    # Load every song's inputs first, a song that can't be loaded is left out
+    results = []
+    timeline = []
+    for i, song in indexed_songs:
+        result = {
+            'index': i,
+            'song_name': song.get('song_name', ''),
+            'output_path': None,
+            'uploads': [],
+            'error': None,
+            'pid': os.getpid(),
+        }
+        results.append(result)
+        try:
+            assets = download_song_assets(song)
+            audio_samples = None
+            if assets['has_audio']:
+                audio_samples = decode_song_audio(assets['audio_path'], CLIP_DURATION)
+            artwork, artwork_stats = load_artwork(assets['artwork_bytes'], scale_px(ARTWORK_SIZE, scale))
+            print_artwork_stats(artwork_stats)
+        except Exception as e:
+            print(f"Error loading video {i+1} for '{result['song_name']}': {e}")
+            traceback.print_exc()
+            result['error'] = str(e)
+            continue
+        
+        # Every song fills exactly its slot on the shared audio track
+        audio_slot = np.zeros((samples_per_song, AUDIO_CHANNELS), dtype=np.int16)
+        if audio_samples is not None:
+            audio_slot[:len(audio_samples)] = audio_samples[:samples_per_song]
+        
+        timeline.append({
+            'result': result,
+            'song': song,
+            'has_audio': audio_samples is not None,
+            'artwork': artwork,
+            'audio': audio_slot,
+            'fingerprint': compute_render_fingerprint(
+                song, audio_samples is not None, assets['artwork_bytes'], assets['audio_bytes'], size, encoder_profile
+            ),
+        })
+    
+    if not timeline:
+        return results
+    
+    # Lay out each song when the stream reaches it
+    current = {'position': None, 'render_frame': None}
+    
+    def render_frame(t, out=None):
+        frame = int(round(t * VIDEO_FPS))
+        position = min(frame // frames_per_song, len(timeline) - 1)
+        if current['position'] != position:
+            entry = timeline[position]
+            base_color = hex_to_rgb(entry['song']['artwork_bg_color'])
+            current['render_frame'] = create_song_renderer(
+                entry['song'], size, scale, get_cached_background(size, base_color),
+                entry['artwork'], base_color, entry['has_audio'], CLIP_DURATION
+            )
+            current['position'] = position
+        return current['render_frame']((frame - position * frames_per_song) / VIDEO_FPS, out=out)
+    
+    output_dir = os.path.join("video_output", today)
+    os.makedirs(output_dir, exist_ok=True)
+    segment_dir = tempfile.mkdtemp(dir=output_dir)
+    try:
+        print(f"Rendering {len(timeline)} songs in one encoder session")
+        pipeline_stats = encode_rendered_frames(
+            render_frame,
+            frames_per_song * len(timeline),
+            os.path.join(segment_dir, 'segment_%03d.mp4'),
+            size,
+            fps=VIDEO_FPS,
+            profile=encoder_profile,
+            audio_samples=np.concatenate([entry['audio'] for entry in timeline]),
+            segment_times=[CLIP_DURATION * n for n in range(1, len(timeline) + 1)]
+        )
+        print(f"Pipeline: {pipeline_stats['frames']} frames (bottleneck: {pipeline_stats['bottleneck']})")
+        
+        # Name the segments like individually rendered videos
+        for position, entry in enumerate(timeline):
+            result = entry['result']
+            filename = get_video_filename(entry['song'], result['index'], today)
+            result['output_path'] = os.path.join(output_dir, filename)
+            os.replace(os.path.join(segment_dir, f'segment_{position:03d}.mp4'), result['output_path'])
+            result['uploads'].append((
+                (result['output_path'], bucket_name, get_video_blob_name(today, filename)),
+                {'metadata': {FINGERPRINT_METADATA_KEY: entry['fingerprint']}}
+            ))
+            print(f"Video saved to: {result['output_path']}")
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+    
+    # Reels are joined from the individual videos without re-encoding. The
+    # combined stream gives every song an audio track, silent or not.
+    stitched_dir = os.path.join(output_dir, 'stitched')
+    os.makedirs(stitched_dir, exist_ok=True)
+    clips = [entry['result']['output_path'] for entry in timeline]
+    for name, count in STITCHED_REELS:
+        filename = f"stitched_reel_{name}_{today}.mp4"
+        reel_path = concat_videos(clips[:count] if count else clips, os.path.join(stitched_dir, filename))
+        print(f"Reel saved to: {reel_path}")
+    
+    # Upload the individual videos at the same GCS paths the separate jobs use
+    uploads = []
+    with ThreadPoolExecutor(max_workers=max(1, upload_workers), thread_name_prefix='upload') as uploader:
+        for entry in timeline:
+            for upload in entry['result']['uploads']:
+                uploads.append((entry['result'], uploader.submit(upload_rendered_video, upload)))
+        wait_for_uploads(uploads)
+    
+    return results
+
+def print_background_cache_stats(results):
+    """Print background cache counters summed over every process that rendered"""
+    per_process = {}
+    for result in results:
+        if result.get('background_cache'):
+            per_process[result['pid']] = result['background_cache']
+    
+    totals = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+    for stats in per_process.values():
+        for key in totals:
+            totals[key] += stats[key]
+    print(f"Background cache: {totals['hits']} hits, {totals['disk_hits']} disk hits, {totals['misses']} misses")
+
+def get_render_record(result):
+    """One song's render stats as a JSON-ready dict"""
+    stages = result.get('stages', {})
+    return {
+        'index': result['index'],
+        'song_name': result['song_name'],
+        'error': result['error'],
+        'resumed': result.get('resumed', False),
+        'peak_rss_mb': result.get('peak_rss_mb'),
+        'timings': result.get('timings', {}),
+        'stages': {
+            name: {
+                'wall_seconds': round(stages[name]['wall_seconds'], 3),
+                'cpu_seconds': round(stages[name]['cpu_seconds'], 3),
+                'bytes': stages[name]['bytes'],
+                'peak_rss_mb': round(stages[name]['peak_rss_mb'], 1),
+            }
+            for name in RENDER_STAGES if name in stages
+        },
+    }
+
+def save_render_stats(results, bucket_name, date, name, wall_seconds, upload=True):
+    """Write the batch's per-song stats and per-stage totals next to the videos.
+    
+    Saved in video_output/{date}/ and, if upload, at videos/{date}/{name}.
+    Resumed songs keep the stats of the run that rendered them (see
+    record_render_result), so a rerun's file still covers every song;
+    wall_seconds is this run's.
+    """
+    records = [get_render_record(result) for result in results]
+    totals = {}
+    for record in records:
+        for stage_name, stage in record['stages'].items():
+            total = totals.setdefault(stage_name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'bytes': 0, 'peak_rss_mb': 0.0})
+            total['wall_seconds'] += stage['wall_seconds']
+            total['cpu_seconds'] += stage['cpu_seconds']
+            total['bytes'] += stage['bytes']
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], stage['peak_rss_mb'])
+    
+    summary = {
+        'date': date,
+        'wall_seconds': round(wall_seconds, 2),
+        'songs': len(records),
+        'failed': sum(1 for record in records if record['error'] is not None),
+        'resumed': sum(1 for record in records if record['resumed']),
+        'stages': {
+            stage_name: {key: round(value, 3) if isinstance(value, float) else value for key, value in total.items()}
+            for stage_name, total in totals.items()
+        },
+        'records': records,
+    }
+    content = json.dumps(summary, indent=2, sort_keys=True)
+    
+    output_dir = os.path.join("video_output", date)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, name), 'w') as f:
+        f.write(content)
+    
+    if upload:
+        blob_name = f"videos/{date}/{name}"
+        try:
+            blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+            blob.upload_from_string(content, content_type='application/json')
+            print(f"Render stats saved to gs://{bucket_name}/{blob_name}")
+        except Exception as e:
+            print(f"Could not save gs://{bucket_name}/{blob_name}: {e}")
+    return summary
+
+def print_render_stage_totals(summary):
+    """Print where the batch's render time went, stage by stage"""
+    for stage_name in RENDER_STAGES:
+        stage = summary['stages'].get(stage_name)
+        if stage:
+            print(f"Stage {stage_name}: {stage['wall_seconds']:.1f}s wall, {stage['cpu_seconds']:.1f}s CPU, "
+                  f"{stage['bytes'] / 1e6:.1f}MB, peak {stage['peak_rss_mb']:.0f}MB")
+
+def parse_shard(shard):
+    """Parse an 'i/n' shard spec (1-based) into (i, n)"""
+    try:
+        shard_index, shard_count = (int(part) for part in shard.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{shard}', expected i/n like 1/3")
+    if shard_count < 1 or not 1 <= shard_index <= shard_count:
+        raise ValueError(f"Invalid shard '{shard}', i must be between 1 and n")
+    return shard_index, shard_count
+
+def select_shard(songs, shard_index=1, shard_count=1):
+    """Pick this shard's (index, song) pairs by round-robin on the song index"""
+    return [
+        (i, song) for i, song in enumerate(songs)
+        if i % shard_count == shard_index - 1
+    ]
+
+def follow_selection(bucket_name, num_songs=SELECTION_SIZE):
+    """Scrape and select today's songs on a background thread, yielding each
+    (index, song) as soon as select_new_songs picks it, best ranked first.
+    
+    Picks need every track's views, so the first song comes once the scrape
+    is done. Each track's assets are downloaded while the scrape goes on to
+    the next one, and each picked song's assets are fetched before it is
+    yielded, so the renders find them on disk. Raises at the end if
+    scraping or selection failed.
+    """
+    # Only needed in this mode, the scraper has its own dependencies
+    import apple_music
+    
+    selected = queue.Queue()
+    errors = []
+    # The scrape waits seconds between tracks, time enough to download one
+    prefetcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+    
+    def select():
+        try:
+            tracks = apple_music.scrape_apple_music(
+                on_scraped=lambda track: prefetcher.submit(prefetch_song_assets, [track])
+            )
+            songs = apple_music.select_new_songs(
+                tracks, bucket_name, num_songs, on_selected=lambda i, song: selected.put((i, song))
+            )
+            print(f"Selected {len(songs)} new songs")
+        except Exception as e:
+            errors.append(e)
+        finally:
+            selected.put(None)
+    
+    threading.Thread(target=select, name='song-selection', daemon=True).start()
+    try:
+        while True:
+            item = selected.get()
+            if item is None:
+                break
+            # Already on disk unless it was scraped on an earlier day
+            prefetch_song_assets([item[1]])
+            yield item
+    finally:
+        prefetcher.shutdown(wait=False, cancel_futures=True)
+    
+    if errors:
+        raise errors[0]
+
+def get_todays_songs(bucket_name, today):
+    """Get the songs selected for today, in the order their indices were assigned"""
+    # Fetch songs data from GCS
+    print(f"Fetching songs data from GCS bucket: {bucket_name}")
+    songs_data = fetch_songs_from_gcs(bucket_name, 'selected_songs.json')
+    
+    # Filter songs with today's date and create_video = True
+    selected_songs = [
+        song for song in songs_data
+        if song.get('selected_date') == today
+    ]
+    
+    print(f"Found {len(selected_songs)} songs with today's date")
+    return selected_songs
+
+def process_latest_songs(shard=None, draft=False, combined=False, scrape=False, memory_budget_mb=None):
+    """Process songs marked for video creation with today's date.
+    
+    draft=True renders small local previews with get_draft_settings() instead.
+    combined=True renders the whole day in one encoder session and also
+    makes the stitched reels (see render_combined_day). scrape=True runs the
+    Apple Music scrape and selection first and renders each song as soon as
+    it is selected (see follow_selection), unless today's songs were already
+    selected by an earlier run. memory_budget_mb renders in
+    streaming mode and limits the parallel songs to the budget.
+    """
+    try:
+        started = time.perf_counter()
+        bucket_name = os.environ.get('GCS_BUCKET_NAME')
         
         # Get today's date
         today = datetime.datetime.now().strftime("%Y-%m-%d")
         print(f"Today's date: {today}")
         
-        # Filter songs with today's date and create_video = True
-        selected_songs = [
-            song for song in songs_data
-            if song.get('selected_date') == today
-        ]
+        shard_index, shard_count = parse_shard(shard) if shard else (1, 1)
+        if combined and (shard_count > 1 or draft):
+            raise ValueError("A combined render covers the whole day at full size, it can't be sharded or a draft")
+        draft_settings = get_draft_settings() if draft else None
+        
+        if scrape and shard_count > 1:
+            raise ValueError("Rendering that follows the selection can't be sharded")
+        
+        # A rerun of the day renders the songs the first run selected
+        # rather than scraping and selecting them again
+        selected_songs = get_todays_songs(bucket_name, today)
+        if scrape and selected_songs:
+            print("Today's songs are already selected, rendering them without scraping")
+            scrape = False
         
-        print(f"Found {len(selected_songs)} songs with today's date")
+        if scrape:
+            # Songs arrive one at a time, best ranked first, with their
+            # assets already downloaded
+            indexed_songs = follow_selection(bucket_name)
+        else:
+            # Only render this machine's share of the songs
+            indexed_songs = select_shard(selected_songs, shard_index, shard_count)
+            if shard_count > 1:
+                print(f"Shard {shard_index}/{shard_count}: rendering {len(indexed_songs)} of {len(selected_songs)} songs")
+        
+        # Songs an earlier run today already finished are confirmed in GCS
+        # and skipped, and every song finished now is recorded
+        resumed = []
+        record_result = None
+        if not (draft or combined):
+            manifest = load_render_manifest(bucket_name, today, get_batch_file_name('render_manifest', today, shard_index, shard_count))
+            song_keys = {}
+            indexed_songs = skip_finished_songs(indexed_songs, manifest, bucket_name, song_keys, resumed)
+            record_result = get_manifest_recorder(manifest, bucket_name, song_keys)
         
-        # Generate videos for each song
-        output_paths = []
-        for i, song in enumerate(selected_songs):
-            print(f"Generating video {i+1}/{len(selected_songs)} for '{song['song_name']}' by {song['artist']}")
-            output_path = generate_music_preview_video(song, index=i)
-            output_paths.append(output_path)
+        if scrape:
+            num_songs = SELECTION_SIZE
+        else:
+            indexed_songs = list(indexed_songs)
+            if resumed:
+                print(f"Resuming: {len(resumed)} songs already rendered, {len(indexed_songs)} left")
+            num_songs = len(indexed_songs)
+            
+            # Get every input onto local disk before rendering starts
+            prefetch_song_assets([song for _, song in indexed_songs])
+        
+        # Generate videos for each song, a failed song doesn't stop the batch
+        if combined:
+            results = render_combined_day(indexed_songs)
+        else:
+            workers = get_render_worker_count(num_songs, memory_budget_mb)
+            if draft_settings:
+                print(f"Draft render at {draft_settings['scale']}x, {draft_settings['fps']} fps, "
+                      f"{draft_settings['duration']}s, nothing is uploaded")
+            results = render_songs(
+                indexed_songs, workers, draft=draft_settings, on_result=record_result, memory_budget_mb=memory_budget_mb
+            )
+        results = sorted(results + resumed, key=lambda result: result['index'])
+        print_background_cache_stats(results)
+        if not combined:
+            stats_name = get_batch_file_name('render_stats', today, shard_index, shard_count)
+            summary = save_render_stats(results, bucket_name, today, stats_name, time.perf_counter() - started, upload=not draft)
+            print_render_stage_totals(summary)
+        
+        output_paths = [result['output_path'] for result in results if result['error'] is None]
+        failures = [result for result in results if result['error'] is not None]
+        if failures:
+            raise BatchRenderError(output_paths, failures)
         
         return output_paths
         
@@ -575,30 +2160,81 @@ def process_latest_songs():
         print(f"Error processing songs: {e}")
         raise
 
-def make_videos_public(bucket_name, date):
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+def verify_rendered_videos(bucket_name, date, formats=None):
+    """Check that every expected video for the date is in GCS, in every output format"""
+    formats = formats or OUTPUT_FORMATS
+    selected_songs = get_todays_songs(bucket_name, date)
+    expected = {
+        get_video_blob_name(date, get_video_filename(song, i, date), name)
+        for i, song in enumerate(selected_songs)
+        for name in formats
+    }
     
-    for blob in bucket.list_blobs(prefix=f"videos/{date}/individual/"):
-        if blob.name.endswith('.mp4'):
-            blob.make_public()
+    bucket = get_storage_client().bucket(bucket_name)
+    uploaded = set()
+    for name in formats:
+        prefix = f"videos/{date}/{get_video_format(name)['folder']}/"
+        uploaded.update(blob.name for blob in bucket.list_blobs(prefix=prefix))
+    
+    missing = sorted(expected - uploaded)
+    print(f"Found {len(expected) - len(missing)}/{len(expected)} expected videos for {date}")
+    for name in missing:
+        print(f"Missing: gs://{bucket_name}/{name}")
+    return missing
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the daily song preview videos")
+    parser.add_argument('--shard', default=os.environ.get('RENDER_SHARD'),
+                        help="Only render shard i of n (1-based), e.g. 2/3")
+    parser.add_argument('--verify', action='store_true',
+                        help="Don't render, just check every expected video is in GCS")
+    parser.add_argument('--scrape', action='store_true',
+                        help="Scrape and select today's songs first, rendering each one as soon as it is selected "
+                             "(a rerun on the same day renders the saved selection)")
+    parser.add_argument('--combined', action='store_true',
+                        help="Render the day in one encoder session and cut the individual videos "
+                             "and local previews of the stitched reels from it")
+    parser.add_argument('--draft', action='store_true',
+                        help="Render small low-fps previews for layout checks without uploading "
+                             "(see DRAFT_SCALE, DRAFT_FPS, DRAFT_DURATION)")
+    parser.add_argument('--memory-budget', type=int,
+                        default=int(RENDER_MEMORY_BUDGET_MB) if RENDER_MEMORY_BUDGET_MB else None,
+                        help="Stream each song and render as many in parallel as fit in this many MB of peak RSS")
+    args = parser.parse_args()
+    
     # Initialize GCP credentials
     init_gcp()
     
     # Configuration - use environment variable for spreadsheet ID
     spreadsheet_id = os.environ.get('SPREADSHEET_ID')
+    bucket_name = os.environ.get('GCS_BUCKET_NAME')
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    
+    if args.verify:
+        # Merge step after all shards have finished
+        missing = verify_rendered_videos(bucket_name, today)
+        if missing:
+            raise SystemExit(f"{len(missing)} videos missing for {today}")
+        raise SystemExit(0)
     
     # Process songs
-    output_paths = process_latest_songs()
+    failed = None
+    try:
+        output_paths = process_latest_songs(
+            shard=args.shard, draft=args.draft, combined=args.combined, scrape=args.scrape,
+            memory_budget_mb=args.memory_budget
+        )
+    except BatchRenderError as e:
+        # Report whatever did render, then fail the job
+        output_paths = e.output_paths
+        failed = e
 
     if output_paths:
         print(f"\nSuccessfully generated {len(output_paths)} videos:")
-        bucket_name = os.environ.get('GCS_BUCKET_NAME')
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
-        make_videos_public(bucket_name, today)
         for path in output_paths:
             print(f"- {path}")
     else:
-        print("No videos were generated")
\ No newline at end of file
+        print("No videos were generated")
+    
+    if failed is not None:
+        raise failed
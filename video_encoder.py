@@ -0,0 +1,432 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import queue
+import numpy as np
+
+# Same ffmpeg binary MoviePy is pointed at
+FFMPEG_BINARY = os.environ.get("IMAGEIO_FFMPEG_EXE", "ffmpeg")
+
+# Named x264 settings so each job can trade encode time against file size.
+# threads=0 lets x264 pick based on the number of cores.
+ENCODER_PROFILES = {
+    'fast-draft': {
+        'preset': 'ultrafast',
+        'crf': 30,
+        'tune': 'zerolatency',
+        'threads': 0,
+        'faststart': False,
+    },
+    'balanced': {
+        'preset': 'veryfast',
+        'crf': 23,
+        'tune': 'stillimage',
+        'threads': 0,
+        'faststart': True,
+    },
+    'archive': {
+        'preset': 'slow',
+        'crf': 18,
+        'tune': 'stillimage',
+        'threads': 0,
+        'faststart': True,
+    },
+}
+
+DEFAULT_ENCODER_PROFILE = os.environ.get("ENCODER_PROFILE", "balanced")
+
+# Raw PCM handed to ffmpeg: signed 16-bit, interleaved
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+
+# Number of reusable frame buffers shared by the render and encode threads
+PIPELINE_BUFFERS = int(os.environ.get("PIPELINE_BUFFERS", "4"))
+
+def get_encoder_profile(profile=None):
+    """Look up encoder settings by profile name (or pass a settings dict through)"""
+    if profile is None:
+        profile = DEFAULT_ENCODER_PROFILE
+    if isinstance(profile, dict):
+        return profile
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile '{profile}'. Available: {', '.join(ENCODER_PROFILES)}")
+    return ENCODER_PROFILES[profile]
+
+def decode_audio(path, duration=None, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS):
+    """Decode (the start of) an audio file to a (samples, channels) int16 array"""
+    command = [FFMPEG_BINARY, '-v', 'error', '-i', path]
+    if duration is not None:
+        command += ['-t', str(duration)]
+    command += ['-f', 's16le', '-acodec', 'pcm_s16le', '-ar', str(sample_rate), '-ac', str(channels), '-']
+    
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        error_output = result.stderr.decode('utf-8', errors='replace').strip()
+        raise IOError(f"ffmpeg failed decoding {path} (exit code {result.returncode}): {error_output}")
+    
+    samples = np.frombuffer(result.stdout, dtype=np.int16)
+    return samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+
+def apply_audio_fades(samples, sample_rate=AUDIO_SAMPLE_RATE, fade_in=0, fade_out=0):
+    """Linear fade in/out over int16 samples, same curve as MoviePy's audio_fadein/out"""
+    duration = len(samples) / sample_rate
+    t = np.arange(len(samples), dtype=np.float32) / sample_rate
+    envelope = np.ones(len(samples), dtype=np.float32)
+    if fade_in > 0:
+        envelope *= np.clip(t / fade_in, 0, 1)
+    if fade_out > 0:
+        envelope *= np.clip((duration - t) / fade_out, 0, 1)
+    
+    faded = samples.astype(np.float32) * envelope[:, None]
+    return np.round(faded).astype(np.int16)
+
+def build_ffmpeg_command(output_path, size, fps=24, profile=None, audio_path=None, audio_codec='aac', audio_bitrate='192k', audio_pcm=None, segment_times=None):
+    """Build the ffmpeg command that reads raw RGB frames from stdin.
+    
+    audio_pcm=(sample_rate, channels) means audio_path is raw s16le PCM,
+    usually a pipe, rather than an audio file. segment_times (seconds) cuts
+    the output into separate files at keyframes forced at those times, and
+    output_path is then a pattern like 'segment_%03d.mp4'.
+    """
+    settings = get_encoder_profile(profile)
+    width, height = size
+    
+    command = [
+        FFMPEG_BINARY, '-y', '-loglevel', 'error', '-nostats',
+        # Raw frames straight from Python
+        '-f', 'rawvideo',
+        '-vcodec', 'rawvideo',
+        '-pix_fmt', 'rgb24',
+        '-s', f'{width}x{height}',
+        '-r', str(fps),
+        '-i', '-',
+    ]
+    if audio_path:
+        if audio_pcm:
+            sample_rate, channels = audio_pcm
+            command += ['-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels)]
+        command += ['-i', audio_path]
+    
+    command += [
+        '-map', '0:v:0',
+        '-c:v', 'libx264',
+        '-preset', settings['preset'],
+        '-crf', str(settings['crf']),
+        '-threads', str(settings.get('threads', 0)),
+        '-pix_fmt', 'yuv420p',
+    ]
+    if settings.get('tune'):
+        command += ['-tune', settings['tune']]
+    if segment_times:
+        cut_times = ','.join(f'{t:g}' for t in segment_times)
+        command += ['-force_key_frames', cut_times]
+    
+    if audio_path:
+        command += ['-map', '1:a:0', '-c:a', audio_codec, '-b:a', audio_bitrate]
+        # PCM samples are already cut to the clip. -shortest would make
+        # ffmpeg hold seconds of raw frames to line the two streams up.
+        if not audio_pcm:
+            command += ['-shortest']
+    else:
+        command += ['-an']
+    
+    if segment_times:
+        command += ['-f', 'segment', '-segment_times', cut_times, '-reset_timestamps', '1', '-segment_format', 'mp4']
+        if settings.get('faststart'):
+            command += ['-segment_format_options', 'movflags=+faststart']
+    elif settings.get('faststart'):
+        command += ['-movflags', '+faststart']
+    
+    command.append(output_path)
+    return command
+
+def write_audio_samples(fd, samples):
+    """Write PCM samples to a pipe and close it (runs on its own thread)"""
+    with os.fdopen(fd, 'wb') as pipe:
+        try:
+            pipe.write(np.ascontiguousarray(samples, dtype=np.int16).data)
+        except BrokenPipeError:
+            # ffmpeg stopped reading, close_video_encoder reports any error
+            pass
+
+def open_video_encoder(output_path, size, fps=24, profile=None, audio_path=None, audio_samples=None, sample_rate=AUDIO_SAMPLE_RATE, segment_times=None):
+    """Start an ffmpeg process that encodes frames written to its stdin.
+    
+    Audio comes from audio_path, or from audio_samples (int16 PCM) streamed
+    through a second pipe so it never touches the disk.
+    """
+    audio_pcm = None
+    audio_fd = None
+    pass_fds = ()
+    if audio_samples is not None:
+        read_fd, audio_fd = os.pipe()
+        audio_path = f'pipe:{read_fd}'
+        audio_pcm = (sample_rate, audio_samples.shape[1])
+        pass_fds = (read_fd,)
+    
+    command = build_ffmpeg_command(output_path, size, fps, profile, audio_path, audio_pcm=audio_pcm, segment_times=segment_times)
+    
+    # stderr goes to a temp file so a chatty ffmpeg can never block the pipe
+    stderr_file = tempfile.TemporaryFile()
+    try:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr_file,
+            pass_fds=pass_fds
+        )
+    finally:
+        # ffmpeg holds its own copy of the read end
+        for fd in pass_fds:
+            os.close(fd)
+    
+    audio_writer = None
+    if audio_fd is not None:
+        audio_writer = threading.Thread(
+            target=write_audio_samples, args=(audio_fd, audio_samples), name='audio-writer', daemon=True
+        )
+        audio_writer.start()
+    
+    return {
+        'process': process,
+        'stderr': stderr_file,
+        'audio_writer': audio_writer,
+        'output_path': output_path,
+        'size': tuple(size),
+        'frames': 0,
+    }
+
+def write_frame(encoder, frame):
+    """Send one (height, width, 3) uint8 frame to the encoder"""
+    width, height = encoder['size']
+    if frame.shape != (height, width, 3) or frame.dtype != np.uint8:
+        raise ValueError(f"Expected a {height}x{width}x3 uint8 frame, got {frame.shape} {frame.dtype}")
+    
+    try:
+        encoder['process'].stdin.write(np.ascontiguousarray(frame).data)
+    except BrokenPipeError:
+        # ffmpeg died - close_video_encoder reports why
+        close_video_encoder(encoder)
+        raise
+    encoder['frames'] += 1
+
+def close_video_encoder(encoder):
+    """Finish encoding and raise if ffmpeg failed"""
+    process = encoder['process']
+    try:
+        if process.stdin and not process.stdin.closed:
+            process.stdin.close()
+    except BrokenPipeError:
+        pass
+    returncode = process.wait()
+    if encoder.get('audio_writer'):
+        encoder['audio_writer'].join()
+    
+    stderr_file = encoder['stderr']
+    stderr_file.seek(0)
+    error_output = stderr_file.read().decode('utf-8', errors='replace').strip()
+    stderr_file.close()
+    
+    if returncode != 0:
+        raise IOError(f"ffmpeg failed writing {encoder['output_path']} (exit code {returncode}): {error_output}")
+    return encoder['output_path']
+
+def close_video_encoder_quietly(encoder):
+    """Close an encoder after an error without masking the original exception"""
+    try:
+        close_video_encoder(encoder)
+    except Exception:
+        pass
+
+def encode_frames(frames, output_path, size, fps=24, profile=None, audio_path=None, audio_samples=None):
+    """Encode an iterable of frames into output_path"""
+    encoder = open_video_encoder(output_path, size, fps, profile, audio_path, audio_samples)
+    try:
+        for frame in frames:
+            write_frame(encoder, frame)
+    except Exception:
+        encoder['process'].kill()
+        close_video_encoder_quietly(encoder)
+        raise
+    return close_video_encoder(encoder)
+
+def get_stream_types(path):
+    """Kinds of stream in a media file, e.g. ('audio', 'video')"""
+    # ffmpeg without an output lists the inputs' streams and exits with an error
+    result = subprocess.run(
+        [FFMPEG_BINARY, '-hide_banner', '-i', path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    output = result.stderr.decode('utf-8', errors='replace')
+    types = set()
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith('Stream #'):
+            for kind in ('Video', 'Audio', 'Subtitle', 'Data'):
+                if f": {kind}:" in line:
+                    types.add(kind.lower())
+    if not types:
+        raise IOError(f"ffmpeg found no streams in {path}: {output.strip()}")
+    return tuple(sorted(types))
+
+def concat_videos(input_paths, output_path):
+    """Join videos encoded with the same settings by stream copy, without re-encoding.
+    
+    Raises ValueError if the inputs don't all have the same kinds of stream:
+    the concat demuxer takes the streams from the first input, so a silent
+    clip would drop or leave a gap in the audio of the rest.
+    """
+    stream_types = {path: get_stream_types(path) for path in input_paths}
+    if len(set(stream_types.values())) > 1:
+        raise ValueError("Can't join by stream copy, the inputs have different streams: " + ", ".join(
+            f"{os.path.basename(path)} {'+'.join(types)}" for path, types in stream_types.items()
+        ))
+    
+    list_file = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    with list_file:
+        for path in input_paths:
+            # Quoting for the concat demuxer's file list
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    
+    command = [
+        FFMPEG_BINARY, '-y', '-loglevel', 'error', '-nostats',
+        '-f', 'concat', '-safe', '0', '-i', list_file.name,
+        '-c', 'copy', '-movflags', '+faststart',
+        output_path
+    ]
+    try:
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    finally:
+        os.remove(list_file.name)
+    
+    if result.returncode != 0:
+        error_output = result.stderr.decode('utf-8', errors='replace').strip()
+        raise IOError(f"ffmpeg failed joining {output_path} (exit code {result.returncode}): {error_output}")
+    return output_path
+
+def encode_clip(clip, output_path, fps=24, profile=None, temp_dir=None):
+    """Encode a MoviePy clip through the ffmpeg pipe, including its audio"""
+    audio_path = None
+    cleanup_dir = None
+    if clip.audio is not None:
+        if temp_dir is None:
+            temp_dir = cleanup_dir = tempfile.mkdtemp()
+        # Uncompressed audio, ffmpeg encodes it to AAC while muxing
+        audio_path = os.path.join(temp_dir, 'audio.wav')
+        # Composed audio ends with the last clip that has sound, pad it with
+        # silence to the full length or -shortest would cut the video there
+        clip.audio.set_duration(clip.duration).write_audiofile(audio_path, fps=44100, nbytes=2, codec='pcm_s16le', logger=None)
+    
+    try:
+        frames = clip.iter_frames(fps=fps, dtype='uint8')
+        return encode_frames(frames, output_path, clip.size, fps, profile, audio_path)
+    finally:
+        if cleanup_dir:
+            shutil.rmtree(cleanup_dir, ignore_errors=True)
+
+
+def encode_rendered_frames(render_frame, num_frames, output_path, size, fps=24, profile=None, audio_path=None, num_buffers=None, audio_samples=None, segment_times=None):
+    """Render and encode at the same time with a producer and a consumer thread.
+    
+    render_frame(t, out=buffer) fills one of a small ring of preallocated
+    buffers on the producer thread while the consumer thread writes finished
+    buffers to ffmpeg. Returns the pipeline counters: a producer stall means
+    it waited for a free buffer (encoder is the bottleneck), a consumer stall
+    means it waited for a rendered frame (rendering is the bottleneck).
+    """
+    if num_buffers is None:
+        num_buffers = PIPELINE_BUFFERS
+    num_buffers = max(2, num_buffers)
+    width, height = size
+    
+    free_buffers = queue.Queue()
+    for _ in range(num_buffers):
+        free_buffers.put(np.empty((height, width, 3), dtype=np.uint8))
+    # Bounded by the number of buffers in the ring
+    ready_frames = queue.Queue()
+    
+    stats = {
+        'frames': 0,
+        'buffers': num_buffers,
+        'producer_stalls': 0,
+        'consumer_stalls': 0,
+        'max_queue_depth': 0,
+        'queue_depth_total': 0,
+        'render_seconds': 0.0,
+        'encode_seconds': 0.0,
+    }
+    errors = []
+    stop = threading.Event()
+    
+    def take(source, stall_key):
+        # Count a stall whenever the other side has not kept up
+        try:
+            return source.get_nowait()
+        except queue.Empty:
+            stats[stall_key] += 1
+        while not stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+    
+    def produce():
+        try:
+            for i in range(num_frames):
+                buffer = take(free_buffers, 'producer_stalls')
+                if buffer is None:
+                    return
+                started = time.perf_counter()
+                render_frame(i / fps, out=buffer)
+                stats['render_seconds'] += time.perf_counter() - started
+                ready_frames.put(buffer)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            ready_frames.put(None)
+    
+    encoder = open_video_encoder(output_path, size, fps, profile, audio_path, audio_samples, segment_times=segment_times)
+    
+    def consume():
+        try:
+            while True:
+                depth = ready_frames.qsize()
+                stats['max_queue_depth'] = max(stats['max_queue_depth'], depth)
+                stats['queue_depth_total'] += depth
+                buffer = take(ready_frames, 'consumer_stalls')
+                if buffer is None:
+                    return
+                started = time.perf_counter()
+                write_frame(encoder, buffer)
+                stats['encode_seconds'] += time.perf_counter() - started
+                stats['frames'] += 1
+                free_buffers.put(buffer)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+    
+    producer = threading.Thread(target=produce, name='frame-producer', daemon=True)
+    consumer = threading.Thread(target=consume, name='frame-consumer', daemon=True)
+    producer.start()
+    consumer.start()
+    producer.join()
+    consumer.join()
+    
+    if errors:
+        encoder['process'].kill()
+        close_video_encoder_quietly(encoder)
+        raise errors[0]
+    close_video_encoder(encoder)
+    
+    stats['mean_queue_depth'] = stats.pop('queue_depth_total') / max(1, stats['frames'])
+    if stats['producer_stalls'] > stats['consumer_stalls']:
+        stats['bottleneck'] = 'encode'
+    else:
+        stats['bottleneck'] = 'render'
+    return stats
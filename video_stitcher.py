@@ -6,12 +6,14 @@ import gspread
 from google.oauth2 import service_account
 from google.cloud import storage
 from moviepy.editor import VideoFileClip, concatenate_videoclips
+from video_encoder import encode_clip, concat_videos
 import shutil
 import json
 
 # Configuration
 SPREADSHEET_ID = os.environ.get("SPREADSHEET_ID")
 GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME")
+STITCH_ENCODER_PROFILE = os.environ.get("STITCH_ENCODER_PROFILE", "balanced")
 
 def init_gcp():
     service_account_json = os.environ.get('GCP_SA_KEY')
@@ -94,6 +96,13 @@ def stitch_videos(video_files, output_path, max_videos=None):
     # Limit videos if max_videos is specified
     videos_to_use = video_files[:max_videos] if max_videos else video_files
     
+    # Clips from video_creator share encoder settings and start on a
+    # keyframe, so they can be joined without encoding any frame again
+    try:
+        return concat_videos(videos_to_use, output_path)
+    except Exception as e:
+        print(f"Stream copy failed, re-encoding instead: {e}")
+    
     try:
         clips = []
         for video_file in videos_to_use:
@@ -103,13 +112,8 @@ def stitch_videos(video_files, output_path, max_videos=None):
         # Concatenate all clips
         final_clip = concatenate_videoclips(clips, method="compose")
         
-        # Write to output file
-        final_clip.write_videofile(
-            output_path,
-            fps=24,
-            codec='libx264',
-            audio_codec='aac'
-        )
+        # Write to output file through the ffmpeg pipe encoder
+        encode_clip(final_clip, output_path, fps=24, profile=STITCH_ENCODER_PROFILE)
         
         # Clean up
         for clip in clips: